@@ -43,6 +43,10 @@ class Settings(BaseSettings):
     Z_API_TOKEN: str = os.getenv("Z_API_TOKEN", "")
     Z_API_SECURITY_TOKEN: str = os.getenv("Z_API_SECURITY_TOKEN", "")
     Z_API_BASE_URL: str = f"https://api.z-api.io/instances/{os.getenv('Z_API_ID', '')}/token/{os.getenv('Z_API_TOKEN', '')}"
+    # Envia áudios como multipart/form-data (binário) em vez de data URL base64 no JSON
+    Z_API_AUDIO_MULTIPART: bool = os.getenv("Z_API_AUDIO_MULTIPART", "False").lower() == "true"
+    # Comprime com gzip (Content-Encoding) o corpo JSON dos áudios grandes em base64
+    Z_API_AUDIO_GZIP: bool = os.getenv("Z_API_AUDIO_GZIP", "False").lower() == "true"
     
     # Configurações da Zaia
     ZAIA_BASE_URL: str = os.getenv("ZAIA_BASE_URL", "https://api.zaia.app")
@@ -69,6 +73,7 @@ class Settings(BaseSettings):
     # Configurações do Redis para cache distribuído
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     REDIS_ENABLED: bool = os.getenv("REDIS_ENABLED", "False").lower() == "true"
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
     
     # Notion
     NOTION_API_KEY: str = os.getenv("NOTION_API_KEY")
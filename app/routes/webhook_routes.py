@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import logging
 import re
 from datetime import datetime, timedelta
@@ -235,7 +236,7 @@ async def _handle_zaia_response(phone: str, is_audio: bool, zaia_response: dict)
             if investimento_value:
                 notion_service = NotionService()
                 formatted_investimento = f'Lead quer investir: "{investimento_value}"'
-                notion_service.update_lead_properties(phone, {"Investimento": formatted_investimento})
+                await notion_service.queue_lead_update(phone, {"Investimento": formatted_investimento})
                 logger.info(f"💾 Investimento capturado e salvo no Notion para {phone}: {formatted_investimento}")
         except Exception as e:
             logger.warning(f"Não foi possível salvar 'Investimento' no Notion: {e}")
@@ -266,7 +267,7 @@ async def _process_buffered_messages(phone: str, is_audio: bool, initial_data: d
     sender_name = initial_data.get('senderName')
     notion_service = NotionService()
     qualification_service = QualificationService()
-    lead_data = notion_service.get_lead_data_by_phone(phone)
+    lead_data = await notion_service.get_lead_data_by_phone(phone)
 
     try:
         # 0) Checagem de contexto: se está aguardando pós-saudação, encaminha a próxima mensagem direto para a Zaia
@@ -295,7 +296,7 @@ async def _process_buffered_messages(phone: str, is_audio: bool, initial_data: d
             interpretation = await qualification_service.interpret_name_confirmation_with_ai(suggested_name, message_text)
 
             if interpretation.get("confirmation") == "positive":
-                notion_service.update_lead_properties(phone, {"Cliente": suggested_name, "Aguardando Confirmação Nome": False})
+                await notion_service.queue_lead_update(phone, {"Cliente": suggested_name, "Aguardando Confirmação Nome": False})
                 first_message = lead_props.get('Primeira Mensagem') or message_text
                 zaia_prompt = f"Meu nome é {suggested_name}. {first_message}"
                 zaia_response = await ZaiaService.send_message({"text": zaia_prompt, "phone": phone}, metadata={"name": suggested_name})
@@ -303,7 +304,7 @@ async def _process_buffered_messages(phone: str, is_audio: bool, initial_data: d
             
             elif interpretation.get("confirmation") == "new_name":
                 new_name = interpretation.get("name") or suggested_name
-                notion_service.update_lead_properties(phone, {"Cliente": new_name, "Aguardando Confirmação Nome": False})
+                await notion_service.queue_lead_update(phone, {"Cliente": new_name, "Aguardando Confirmação Nome": False})
                 first_message = lead_props.get('Primeira Mensagem') or message_text
                 zaia_prompt = f"Meu nome é {new_name}. {first_message}"
                 zaia_response = await ZaiaService.send_message({"text": zaia_prompt, "phone": phone}, metadata={"name": new_name})
@@ -315,7 +316,7 @@ async def _process_buffered_messages(phone: str, is_audio: bool, initial_data: d
             is_new_lead = not bool(lead_data)
             if is_new_lead:
                 # Salva a primeira mensagem completa no Notion para referência.
-                notion_service.create_or_update_lead(sender_name, phone, initial_data.get('photo'), first_message=message_text)
+                await notion_service.create_or_update_lead(sender_name, phone, initial_data.get('photo'), first_message=message_text)
                 
                 ai_name = await qualification_service.analyze_name_with_ai(sender_name)
                 name_type = (ai_name.get('type') or '').lower()
@@ -323,7 +324,7 @@ async def _process_buffered_messages(phone: str, is_audio: bool, initial_data: d
                 looks_commercial = is_commercial_name(sender_name) or name_type in ['empresa', 'empresa com nome']
 
                 if looks_commercial:
-                    notion_service.update_lead_properties(phone, {"Aguardando Confirmação Nome": True, "Primeira Mensagem": message_text})
+                    await notion_service.queue_lead_update(phone, {"Aguardando Confirmação Nome": True, "Primeira Mensagem": message_text})
                     if name_type == 'empresa com nome' and extracted:
                         confirm_msg = f"Hello Hello, que bom ter você por aqui! Vi aqui que seu nome está como \"{sender_name}\". Posso te chamar de {extracted} mesmo, ou como prefere que eu te chame?"
                         await ZAPIService.send_text_with_typing(phone, confirm_msg)
@@ -441,11 +442,19 @@ async def _process_buffered_messages(phone: str, is_audio: bool, initial_data: d
         logger.error(f"Erro ao processar mensagens bufferizadas para {phone}: {e}") 
 
 
-async def _delayed_message_processor(phone: str, is_audio: bool, initial_data: dict):
+def _discard_message_timer(phone: str, task: asyncio.Task):
+    """
+    Remove o timer do registro ao terminar (concluído, cancelado ou com erro),
+    sem apagar um timer mais novo já agendado para o mesmo telefone.
+    """
+    if _message_timers.get(phone) is task:
+        _message_timers.pop(phone, None)
+
+async def _delayed_message_processor(phone: str, is_audio: bool, initial_data: dict, job_id: str, timer_armed: bool = False):
     """
     Aguarda um tempo e depois processa a mensagem, usando Redis para coordenação.
+    `timer_armed` indica que o job_id já foi gravado junto com a mensagem no buffer.
     """
-    job_id = str(random.randint(1000, 9999))
     timer_key = f"timer_job_id:{phone}"
     
     client = await CacheService._get_redis_client()
@@ -458,12 +467,14 @@ async def _delayed_message_processor(phone: str, is_audio: bool, initial_data: d
             logger.info(f"Timer local cancelado para {phone} (nova mensagem chegou).")
         return
 
-    await client.set(timer_key, job_id, ex=BUFFER_SECONDS + 5)
+    if not timer_armed:
+        await client.set(timer_key, job_id, ex=BUFFER_SECONDS + 5)
     
     await asyncio.sleep(BUFFER_SECONDS)
 
+    # O cliente Redis devolve bytes; compara direto com o job_id codificado
     current_job_id = await client.get(timer_key)
-    if current_job_id == job_id:
+    if current_job_id == job_id.encode():
         await _process_buffered_messages(phone, is_audio, initial_data)
     else:
         logger.info(f"Processamento para {phone} cancelado por um job mais recente.")
@@ -498,9 +509,10 @@ async def handle_webhook(request: Request):
                         logger.info(f"ℹ️ Mensagem fromMe originada pela API ignorada para override ({phone})")
                         return JSONResponse({"status": "ignored_api_message"})
 
+                    text_payload = data.get('text')
                     text_message = ''
-                    if isinstance(data.get('text'), dict):
-                        text_message = (data.get('text', {}).get('message') or '').strip().lower()
+                    if isinstance(text_payload, dict):
+                        text_message = (text_payload.get('message') or '').strip().lower()
 
                     # Comandos simples para desativar/ativar o override humano
                     disable_commands = {"bot on", "agente on", "ativar bot", "retomar bot"}
@@ -537,10 +549,13 @@ async def handle_webhook(request: Request):
             openai_service = OpenAIService()
             settings = Settings()
 
-            qualification_level = await qualification_service.classify_lead(motivo, profissao)
+            # Classificação (OpenAI) e leitura do lead (Notion) são independentes: rodam em paralelo
+            qualification_level, lead_current_data = await asyncio.gather(
+                qualification_service.classify_lead(motivo, profissao),
+                notion_service.get_lead_data_by_phone(phone),
+            )
             logger.info(f"Lead {phone} classificado como: {qualification_level}")
 
-            lead_current_data = notion_service.get_lead_data_by_phone(phone)
             current_status = (lead_current_data.get('properties', {}).get('Status') or '') if lead_current_data else ''
 
             protected_statuses = ["Agendado Reunião", "Reunião Realizada", "Fechado", "Perdido", "Convertido"]
@@ -550,7 +565,7 @@ async def handle_webhook(request: Request):
                 # Adiciona investimento se presente no webhook
                 if 'investimento' in data and data.get('investimento'):
                     updates["Investimento"] = f'Lead quer investir: "{data.get("investimento")}"'
-                notion_service.update_lead_properties(phone, updates)
+                await notion_service.update_lead_properties(phone, updates)
                 return JSONResponse({"status": "lead_status_protected"})
 
             updates = {
@@ -561,21 +576,27 @@ async def handle_webhook(request: Request):
             # Adiciona investimento se presente no webhook
             if 'investimento' in data and data.get('investimento'):
                 updates["Investimento"] = f'Lead quer investir: "{data.get("investimento")}"'
-            notion_service.update_lead_properties(phone, updates)
             
-            lead_full_data = notion_service.get_lead_data_by_phone(phone)
-            lead_properties = lead_full_data.get('properties', {}) if lead_full_data else {}
+            # O lead já foi lido no início do handler: as propriedades atualizadas são montadas
+            # localmente em vez de relidas do Notion depois do PATCH
+            lead_properties = {**(lead_current_data.get('properties', {}) if lead_current_data else {}), **updates}
             alerta_enviado = lead_properties.get('Alerta Enviado', False)
 
             if qualification_level == 'Alto' and not alerta_enviado:
                 logger.info(f"Lead {phone} é de alta prioridade. Notificando equipe.")
-                summary_text = await openai_service.generate_sales_summary(lead_properties)
-                notion_url = lead_full_data.get('url', '')
+                # O resumo depende só de dados já conhecidos: é gerado junto com o PATCH no Notion
+                _, summary_text = await asyncio.gather(
+                    notion_service.update_lead_properties(phone, updates),
+                    openai_service.generate_sales_summary(lead_properties),
+                )
+                notion_url = lead_current_data.get('url', '') if lead_current_data else ''
                 final_message = f"{summary_text}\n\n🔗 *Link do Notion:* {notion_url}\n📱 *WhatsApp do Lead:* https://wa.me/{phone}"
                 for sales_phone in settings.SALES_TEAM_PHONES:
                     await ZAPIService.send_text(sales_phone, final_message)
-                notion_service.update_lead_properties(phone, {"Alerta Enviado": True})
+                await notion_service.update_lead_properties(phone, {"Alerta Enviado": True})
                 logger.info(f"Alerta para {phone} enviado e marcado.")
+            else:
+                await notion_service.update_lead_properties(phone, updates)
 
             return JSONResponse({"status": "lead_qualified_processed"})
 
@@ -592,12 +613,15 @@ async def handle_webhook(request: Request):
                 logger.info(f"🛑 Override humano ativo para {phone}. Não enviaremos resposta automática.")
                 return JSONResponse({"status": "human_override_active_skip"})
             
+            # Cada campo do payload é lido uma única vez
             message_text = ""
-            is_audio = 'audio' in data and data.get('audio')
-            if is_audio:
-                message_text = await WhisperService().transcribe_audio(data['audio']['audioUrl'])
-            elif 'text' in data and data.get('text'):
-                message_text = data['text'].get('message', '')
+            audio_payload = data.get('audio')
+            is_audio = bool(audio_payload)
+            text_payload = data.get('text')
+            if audio_payload:
+                message_text = await WhisperService().transcribe_audio(audio_payload['audioUrl'])
+            elif text_payload:
+                message_text = text_payload.get('message', '')
 
             if not message_text.strip():
                 return JSONResponse({"status": "empty_message_ignored"})
@@ -605,11 +629,16 @@ async def handle_webhook(request: Request):
             is_edit = data.get('isEdit', False)
             message_id = data.get('messageId')
 
+            job_id = str(random.randint(1000, 9999))
+            timer_armed = False
             if is_edit:
                 await CacheService.update_message_in_buffer(phone, message_id, message_text)
                 logger.info(f"Mensagem de {phone} (ID: {message_id}) atualizada no buffer.")
             else:
-                await CacheService.add_message_to_buffer(phone, message_id, message_text)
+                # O job do timer vai no mesmo pipeline da mensagem (um round-trip a menos)
+                timer_armed = await CacheService.add_message_to_buffer(
+                    phone, message_id, message_text, timer_job_id=job_id, timer_ttl=BUFFER_SECONDS + 5
+                )
                 logger.info(f"Mensagem de {phone} adicionada ao buffer. Aguardando próximas mensagens.")
 
             # Reinicia o timer a cada nova mensagem ou edição (fallback sem Redis)
@@ -622,8 +651,9 @@ async def handle_webhook(request: Request):
                     pass
 
             # Agenda um novo timer na mesma event loop em execução
-            task = asyncio.create_task(_delayed_message_processor(phone, is_audio, data))
+            task = asyncio.create_task(_delayed_message_processor(phone, is_audio, data, job_id, timer_armed))
             _message_timers[phone] = task
+            task.add_done_callback(functools.partial(_discard_message_timer, phone))
 
             return JSONResponse({"status": "message_buffered"})
         
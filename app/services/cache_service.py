@@ -1,219 +1,645 @@
 # app/services/cache_service.py
-import logging
-import json
 import asyncio
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+import logging
+import orjson
+import msgpack
+import re
+import time
+import uuid
+from collections import deque
+from typing import Optional, Dict, Any, Tuple
 import redis.asyncio as redis
+from cachetools import TTLCache
 from app.config.settings import settings
+from app.services.circuit_breaker import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+# Avaliado uma única vez no import: as configurações não mudam durante o processo
+_REDIS_ENABLED = settings.is_redis_enabled
+
+# TTLs (em segundos) das chaves gravadas no Redis
+_CONTEXT_TTL = 24 * 3600
+_CHAT_ID_TTL = 7 * 86400
+_NOTION_PAGE_TTL = 24 * 3600
+_NOTION_CREATE_CLAIM_TTL = 60
+_CONTEXT_MARK_TTL = 5 * 60
+_TTS_AUDIO_TTL = 30 * 86400
+_PROFESSION_TTL = 30 * 86400
+_TRANSCRIPT_TTL = 30 * 86400
+_HUMAN_OVERRIDE_TTL = 24 * 3600
+_BUFFER_TTL = 120  # 2 minutos
+
+# Chaves examinadas por chamada ao SCAN (o padrão do Redis, 10, exige um round-trip a cada
+# poucas chaves) e chaves por comando UNLINK em limpezas em massa
+_SCAN_COUNT = 1000
+_UNLINK_BATCH_SIZE = 500
+
+# Prefixos das chaves em bytes: a chave é montada com uma única concatenação
+# (prefixo + telefone codificado) e o redis-py a envia sem nova codificação
+_CHAT_ID_PREFIX = b"chat_id:"
+_HUMAN_OVERRIDE_PREFIX = b"human_override:"
+_NOTION_PAGE_PREFIX = b"notion:page:"
+_NOTION_CREATE_PREFIX = b"notion:creating:"
+_TTS_AUDIO_PREFIX = b"tts:"
+_PROFESSION_PREFIX = b"profession:high_income:"
+_TRANSCRIPT_PREFIX = b"transcript:"
+
+# Contextos são gravados em MessagePack sob o prefixo v2; o prefixo antigo (JSON)
+# continua sendo lido até as entradas legadas expirarem (TTL de 24h)
+_CONTEXT_PREFIX = b"context:v2:"
+# Marcação recente de contexto em lote (deduplica rajadas sem tocar na chave do contexto)
+_CONTEXT_MARK_PREFIX = b"ctx_mark:"
+_LEGACY_CONTEXT_PREFIX = b"context:"
+
+# Buffer de mensagens: hash {message_id: texto} + lista com a ordem de chegada dos IDs
+_BUFFER_MESSAGES_PREFIX = b"buffer_msgs:"
+_BUFFER_ORDER_PREFIX = b"buffer_order:"
+# ID do timer mais recente do buffer (o webhook só processa o buffer se o seu job ainda for o atual)
+_BUFFER_TIMER_PREFIX = b"timer_job_id:"
+
+# Atualiza o texto apenas se o ID já existir no hash (edições de mensagens já processadas são ignoradas)
+_BUFFER_UPDATE_LUA = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Lê o buffer na ordem de chegada (ignorando IDs repetidos) e apaga as duas chaves
+_BUFFER_DRAIN_LUA = """
+local ids = redis.call('LRANGE', KEYS[1], 0, -1)
+local texts = {}
+local seen = {}
+for _, id in ipairs(ids) do
+    if not seen[id] then
+        seen[id] = true
+        local text = redis.call('HGET', KEYS[2], id)
+        if text then
+            table.insert(texts, text)
+        end
+    end
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return texts
+"""
+
+# Circuit breaker: após N falhas seguidas o Redis é ignorado por alguns segundos e
+# todas as operações vão direto para o fallback em memória
+_BREAKER_FAILURE_THRESHOLD = 5
+_BREAKER_RESET_TIMEOUT = 30.0
+# Limite (em segundos) para conectar e para cada comando, para um Redis lento não travar o webhook
+_REDIS_SOCKET_TIMEOUT = 5
+# Erros de infraestrutura que contam como falha para o circuit breaker
+_REDIS_ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+# Fim de uma entrada do buffer (separador ou fim do texto) sem pontuação final
+_BUFFER_PART_SEPARATOR = "\x00"
+_MISSING_END_PUNCT = re.compile(r"(?<![.?!])(?=\x00|\Z)")
+
 class CacheService:
     _redis_client: Optional[redis.Redis] = None
+    _buffer_update_script = None
+    _buffer_drain_script = None
+    _breaker = CircuitBreaker(_BREAKER_FAILURE_THRESHOLD, _BREAKER_RESET_TIMEOUT)
+    # Serializa a conexão inicial/sondagem: handlers concorrentes esperam a mesma tentativa
+    _connect_lock = asyncio.Lock()
 
     # Fallback caches in-memory
     _context_cache: Dict[str, dict] = {}
     _chat_cache: Dict[str, str] = {}
-    _human_override_cache: Dict[str, dict] = {}
-    _message_buffer_cache: Dict[str, list] = {}
-    
-    _message_timers: Dict[str, asyncio.Task] = {}
+    _human_override_cache: Dict[str, int] = {}
+    _notion_page_cache: Dict[str, str] = {}
+    # Buffer em memória: (IDs, textos) em deques paralelos, na ordem de chegada
+    _message_buffer_cache: Dict[str, Tuple[deque, deque]] = {}
+
+    # Cópia local de curta duração dos chat IDs lidos do Redis (evita um GET por mensagem).
+    # O TTL curto limita a defasagem entre workers quando outro processo altera o valor.
+    _chat_id_local: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+
+    @classmethod
+    async def _get_connected_client(cls) -> redis.Redis:
+        """Caminho rápido, sem desvios: usado enquanto o cliente está conectado e o circuito fechado."""
+        return cls._redis_client
 
     @classmethod
-    async def _get_redis_client(cls) -> redis.Redis:
-        # Não tentar conectar se o Redis estiver desabilitado
-        if not settings.is_redis_enabled:
+    async def _connect_redis_client(cls) -> Optional[redis.Redis]:
+        """Retorna o cliente Redis, ou None se o Redis estiver desabilitado ou com o circuito aberto."""
+        # Não tentar conectar se o Redis estiver desabilitado ou se falhou há pouco
+        if not _REDIS_ENABLED or cls._breaker.is_open:
             return None
-        if cls._redis_client is None:
+        async with cls._connect_lock:
+            # Outro handler pode ter conectado (ou falhado) enquanto esperávamos o lock
+            client = cls._redis_client
+            if client is not None and cls._breaker.is_closed:
+                return client
+            if cls._breaker.is_open:
+                return None
+            # Primeira conexão ou circuito meio-aberto: testa o Redis antes de liberar o tráfego
             try:
-                cls._redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-                await cls._redis_client.ping()
-                logger.info("Cliente Redis conectado com sucesso.")
+                if client is None:
+                    # Um único pool por worker, compartilhado por todos os handlers concorrentes
+                    client = redis.from_url(
+                        settings.REDIS_URL,
+                        max_connections=settings.REDIS_MAX_CONNECTIONS,
+                        socket_timeout=_REDIS_SOCKET_TIMEOUT,
+                        socket_connect_timeout=_REDIS_SOCKET_TIMEOUT,
+                    )
+                    cls._buffer_update_script = client.register_script(_BUFFER_UPDATE_LUA)
+                    cls._buffer_drain_script = client.register_script(_BUFFER_DRAIN_LUA)
+                    cls._redis_client = client
+                await client.ping()
             except Exception as e:
-                logger.error(f"Não foi possível conectar ao Redis: {e}. Usando fallback em memória.")
-                cls._redis_client = None
-        return cls._redis_client
+                logger.error(
+                    f"Não foi possível conectar ao Redis: {e}. "
+                    f"Usando fallback em memória pelos próximos {_BREAKER_RESET_TIMEOUT:.0f}s."
+                )
+                cls._breaker.trip()
+                return None
+            cls._breaker.record_success()
+            # Daqui em diante _get_redis_client vira um simples retorno do cliente;
+            # _on_redis_error restaura a versão com verificações quando o circuito abre
+            cls._get_redis_client = cls._get_connected_client
+            logger.info("Cliente Redis conectado com sucesso.")
+            return client
+
+    # Ponto de entrada usado por todos os métodos; alterna entre as duas versões acima
+    _get_redis_client = _connect_redis_client
+
+    @classmethod
+    def _on_redis_success(cls):
+        """Zera a contagem após um comando bem-sucedido: o circuito só abre com falhas seguidas."""
+        if cls._breaker.failures:
+            cls._breaker.record_success()
+
+    @classmethod
+    def _on_redis_error(cls, error: Exception):
+        """Registra a falha de uma operação no Redis; o chamador segue pelo fallback em memória."""
+        cls._breaker.record_failure()
+        if cls._breaker.is_open:
+            cls._get_redis_client = cls._connect_redis_client
+            logger.error(
+                f"Redis falhou {cls._breaker.failures} vezes seguidas ({error}). "
+                f"Circuito aberto: usando fallback em memória por {_BREAKER_RESET_TIMEOUT:.0f}s."
+            )
+        else:
+            logger.warning(f"⚠️ Falha em operação no Redis: {error}. Usando fallback em memória.")
 
     @staticmethod
     async def set_context_data(phone: str, context_data: dict):
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                await client.set(f"context:{phone}", json.dumps(context_data), ex=timedelta(hours=24))
-        else:
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.set(_CONTEXT_PREFIX + phone.encode(), msgpack.packb(context_data, use_bin_type=True), ex=_CONTEXT_TTL)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+                client = None
+        if not client:
             CacheService._context_cache[phone] = context_data
         logger.info(f"💾 Contexto armazenado para {phone}")
 
+    @staticmethod
+    async def set_context_data_many(items: Dict[str, dict], ttl: int = _CONTEXT_TTL, dedupe: bool = False) -> Dict[str, dict]:
+        """Armazena o contexto de vários telefones em pipeline e retorna os contextos gravados.
+
+        Com `dedupe`, cada telefone primeiro reserva uma chave de marcação curta
+        (`ctx_mark:`, SET NX com a janela de 5 minutos); só os telefones sem marcação recente
+        têm o contexto regravado, sempre por inteiro e com o TTL normal. Quem já foi marcado
+        na janela mantém o contexto gravado, cujo timestamp ainda está dentro dela.
+        O fallback em memória sempre grava.
+        """
+        if not items:
+            return items
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                if dedupe:
+                    async with client.pipeline(transaction=False) as pipe:
+                        for phone in items:
+                            pipe.set(_CONTEXT_MARK_PREFIX + phone.encode(), b"1", nx=True, ex=_CONTEXT_MARK_TTL)
+                        claimed = await pipe.execute()
+                    items = {phone: data for (phone, data), ok in zip(items.items(), claimed) if ok}
+                if items:
+                    async with client.pipeline(transaction=False) as pipe:
+                        for phone, context_data in items.items():
+                            pipe.set(
+                                _CONTEXT_PREFIX + phone.encode(),
+                                msgpack.packb(context_data, use_bin_type=True),
+                                ex=ttl,
+                            )
+                        await pipe.execute()
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+                client = None
+        if not client:
+            CacheService._context_cache.update(items)
+        logger.info(f"💾 Contexto armazenado para {len(items)} telefones")
+        return items
+
     @staticmethod
     async def get_context_data(phone: str) -> Optional[dict]:
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                data = await client.get(f"context:{phone}")
-                return json.loads(data) if data else None
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                # Lê a chave nova e a legada no mesmo round-trip (janela de migração)
+                phone_key = phone.encode()
+                data, legacy_data = await client.mget(_CONTEXT_PREFIX + phone_key, _LEGACY_CONTEXT_PREFIX + phone_key)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+            else:
+                if data:
+                    return msgpack.unpackb(data, raw=False)
+                return orjson.loads(legacy_data) if legacy_data else None
         return CacheService._context_cache.get(phone)
 
     @staticmethod
     async def clear_context_data(phone: str):
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                await client.delete(f"context:{phone}")
-        else:
-            CacheService._context_cache.pop(phone, None)
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                phone_key = phone.encode()
+                await client.delete(
+                    _CONTEXT_PREFIX + phone_key, _LEGACY_CONTEXT_PREFIX + phone_key, _CONTEXT_MARK_PREFIX + phone_key
+                )
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+        CacheService._context_cache.pop(phone, None)
         logger.info(f"🧹 Contexto limpo para {phone}")
 
     @staticmethod
     async def set_chat_id(phone: str, chat_id: str):
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                await client.set(f"chat_id:{phone}", chat_id, ex=timedelta(days=7))
-        else:
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.set(_CHAT_ID_PREFIX + phone.encode(), chat_id, ex=_CHAT_ID_TTL)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+                client = None
+            else:
+                CacheService._chat_id_local[phone] = chat_id
+        if not client:
             CacheService._chat_cache[phone] = chat_id
         logger.info(f"🆔 Chat ID armazenado para {phone}: {chat_id}")
 
     @staticmethod
     async def get_chat_id(phone: str) -> Optional[str]:
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                return await client.get(f"chat_id:{phone}")
+        client = await CacheService._get_redis_client()
+        if client:
+            chat_id = CacheService._chat_id_local.get(phone)
+            if chat_id is not None:
+                return chat_id
+            try:
+                # GETEX renova o TTL na própria leitura: chats em uso não expiram
+                chat_id = await client.getex(_CHAT_ID_PREFIX + phone.encode(), ex=_CHAT_ID_TTL)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+            else:
+                if not chat_id:
+                    return None
+                chat_id = CacheService._chat_id_local[phone] = chat_id.decode()
+                return chat_id
         return CacheService._chat_cache.get(phone)
 
     @staticmethod
     async def clear_chat_id(phone: str):
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                await client.delete(f"chat_id:{phone}")
-        else:
-            CacheService._chat_cache.pop(phone, None)
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.delete(_CHAT_ID_PREFIX + phone.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+        CacheService._chat_id_local.pop(phone, None)
+        CacheService._chat_cache.pop(phone, None)
         logger.info(f"🆔 Chat ID limpo para {phone}")
 
     @staticmethod
     async def clear_all_chats():
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                async for key in client.scan_iter("chat_id:*"):
-                    await client.delete(key)
-        else:
-            CacheService._chat_cache.clear()
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                # Remove em lotes (um UNLINK por página do SCAN) em vez de um DEL por chave
+                batch = []
+                async for key in client.scan_iter(_CHAT_ID_PREFIX + b"*", count=_SCAN_COUNT):
+                    batch.append(key)
+                    if len(batch) >= _UNLINK_BATCH_SIZE:
+                        await client.unlink(*batch)
+                        batch.clear()
+                if batch:
+                    await client.unlink(*batch)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+        CacheService._chat_id_local.clear()
+        CacheService._chat_cache.clear()
         logger.info("🧹 Todos os chat IDs foram limpos")
 
     @staticmethod
     async def get_all_context_data() -> Dict[str, dict]:
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
                 contexts = {}
-                async for key in client.scan_iter("context:*"):
-                    phone = key.split(":")[-1]
+                async for key in client.scan_iter(_LEGACY_CONTEXT_PREFIX + b"*", count=_SCAN_COUNT):
+                    phone = key.decode().split(":")[-1]
                     data = await client.get(key)
-                    if data:
-                        contexts[phone] = json.loads(data)
+                    if not data:
+                        continue
+                    if key.startswith(_CONTEXT_PREFIX):
+                        contexts[phone] = msgpack.unpackb(data, raw=False)
+                    else:
+                        # Entradas legadas (JSON) não sobrescrevem as já migradas
+                        contexts.setdefault(phone, orjson.loads(data))
+                CacheService._on_redis_success()
                 return contexts
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
         return CacheService._context_cache.copy()
 
     @staticmethod
     async def get_all_chat_ids() -> Dict[str, str]:
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
                 chats = {}
-                async for key in client.scan_iter("chat_id:*"):
-                    phone = key.split(":")[-1]
+                async for key in client.scan_iter(_CHAT_ID_PREFIX + b"*", count=_SCAN_COUNT):
+                    phone = key.decode().split(":")[-1]
                     chat_id = await client.get(key)
                     if chat_id:
-                        chats[phone] = chat_id
+                        chats[phone] = chat_id.decode()
+                CacheService._on_redis_success()
                 return chats
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
         return CacheService._chat_cache.copy()
 
     @staticmethod
     async def set_human_override(phone: str, active: bool = True):
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                key = f"human_override:{phone}"
+        client = await CacheService._get_redis_client()
+        if client:
+            key = _HUMAN_OVERRIDE_PREFIX + phone.encode()
+            try:
                 if active:
-                    data = {"active": True, "since": datetime.utcnow().isoformat()}
-                    await client.set(key, json.dumps(data), ex=timedelta(hours=24))
-                    logger.info(f"🛑 Override humano ATIVADO para {phone}")
+                    # Apenas a existência da chave importa; o valor guarda o início do override
+                    await client.set(key, int(time.time()), ex=_HUMAN_OVERRIDE_TTL)
                 else:
                     await client.delete(key)
-                    logger.info(f"▶️ Override humano DESATIVADO para {phone}")
-        else:
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+                client = None
+        if not client:
             if active:
-                CacheService._human_override_cache[phone] = {
-                    "active": True,
-                    "since": datetime.utcnow().isoformat()
-                }
-                logger.info(f"🛑 Override humano ATIVADO para {phone}")
+                CacheService._human_override_cache[phone] = int(time.time())
             else:
                 CacheService._human_override_cache.pop(phone, None)
-                logger.info(f"▶️ Override humano DESATIVADO para {phone}")
+        if active:
+            logger.info(f"🛑 Override humano ATIVADO para {phone}")
+        else:
+            logger.info(f"▶️ Override humano DESATIVADO para {phone}")
 
     @staticmethod
     async def is_human_override_active(phone: str) -> bool:
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                key = f"human_override:{phone}"
-                data = await client.get(key)
-                if data:
-                    return json.loads(data).get("active", False)
-                return False
-        
-        data = CacheService._human_override_cache.get(phone)
-        return bool(data and data.get("active"))
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                active = await client.exists(_HUMAN_OVERRIDE_PREFIX + phone.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+            else:
+                return bool(active)
+
+        return phone in CacheService._human_override_cache
 
     @staticmethod
     async def clear_human_override(phone: str):
-        if settings.is_redis_enabled:
-            client = await CacheService._get_redis_client()
-            if client:
-                await client.delete(f"human_override:{phone}")
-        else:
-            CacheService._human_override_cache.pop(phone, None)
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.delete(_HUMAN_OVERRIDE_PREFIX + phone.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+        CacheService._human_override_cache.pop(phone, None)
         logger.info(f"▶️ Override humano limpo para {phone}")
 
+    @staticmethod
+    async def set_notion_page_id(phone: str, page_id: str):
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.set(_NOTION_PAGE_PREFIX + phone.encode(), page_id, ex=_NOTION_PAGE_TTL)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+                client = None
+        if not client:
+            CacheService._notion_page_cache[phone] = page_id
+
+    @staticmethod
+    async def get_notion_page_id(phone: str) -> Optional[str]:
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                page_id = await client.get(_NOTION_PAGE_PREFIX + phone.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+            else:
+                return page_id.decode() if page_id else None
+        return CacheService._notion_page_cache.get(phone)
+
+    @staticmethod
+    async def clear_notion_page_id(phone: str):
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.delete(_NOTION_PAGE_PREFIX + phone.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+        CacheService._notion_page_cache.pop(phone, None)
+
+    @staticmethod
+    async def claim_notion_page_creation(phone: str) -> bool:
+        """
+        Reserva (SET NX) a criação da página do lead entre os workers. Retorna False se
+        outro worker já estiver criando a página; sem Redis, sempre True (a trava local basta).
+        """
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                claimed = await client.set(_NOTION_CREATE_PREFIX + phone.encode(), b"1", nx=True, ex=_NOTION_CREATE_CLAIM_TTL)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+            else:
+                return bool(claimed)
+        return True
+
+    @staticmethod
+    async def release_notion_page_creation(phone: str):
+        """Libera a reserva de criação (após criar ou falhar), sem esperar o TTL expirar."""
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.delete(_NOTION_CREATE_PREFIX + phone.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+
+    # Áudios gerados (MP3) ficam só no Redis: sem fallback em memória, pelo tamanho dos arquivos
+    @staticmethod
+    async def get_tts_audio(key: str) -> Optional[bytes]:
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                audio = await client.get(_TTS_AUDIO_PREFIX + key.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+            else:
+                return audio
+        return None
+
+    @staticmethod
+    async def set_tts_audio(key: str, audio: bytes):
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.set(_TTS_AUDIO_PREFIX + key.encode(), audio, ex=_TTS_AUDIO_TTL)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+
+    # Transcrições de áudio: só no Redis, endereçadas pelo hash da URL e/ou do conteúdo
+    @staticmethod
+    async def get_transcript(key: str) -> Optional[str]:
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                text = await client.get(_TRANSCRIPT_PREFIX + key.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+            else:
+                return text.decode() if text is not None else None
+        return None
+
+    @staticmethod
+    async def set_transcript(keys: list, text: str):
+        """Grava a mesma transcrição sob várias chaves em um único round-trip (pipeline)."""
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.set(_TRANSCRIPT_PREFIX + key.encode(), text, ex=_TRANSCRIPT_TTL)
+                    await pipe.execute()
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+
+    # Classificação de profissões (alta renda ou não): só no Redis, compartilhada entre os workers
+    @staticmethod
+    async def get_profession_high_income(profession: str) -> Optional[bool]:
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                value = await client.get(_PROFESSION_PREFIX + profession.encode())
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+            else:
+                return None if value is None else value == b"1"
+        return None
+
+    @staticmethod
+    async def set_profession_high_income(profession: str, high_income: bool):
+        client = await CacheService._get_redis_client()
+        if client:
+            try:
+                await client.set(_PROFESSION_PREFIX + profession.encode(), b"1" if high_income else b"0", ex=_PROFESSION_TTL)
+                CacheService._on_redis_success()
+            except _REDIS_ERRORS as e:
+                CacheService._on_redis_error(e)
+
     @classmethod
-    async def add_message_to_buffer(cls, phone: str, message_id: str, message_text: str):
-        """Adiciona uma mensagem com ID ao buffer."""
-        message_obj = {'id': message_id, 'text': message_text}
-        client = await cls._get_redis_client() if settings.is_redis_enabled else None
-        if client:
-            key = f"buffer:{phone}"
-            await client.rpush(key, json.dumps(message_obj))
-            await client.expire(key, 120)  # Expira em 2 minutos
-        else:
-            if phone not in cls._message_buffer_cache:
-                cls._message_buffer_cache[phone] = []
-            cls._message_buffer_cache[phone].append(message_obj)
+    async def add_message_to_buffer(
+        cls,
+        phone: str,
+        message_id: str,
+        message_text: str,
+        timer_job_id: Optional[str] = None,
+        timer_ttl: int = _BUFFER_TTL,
+    ) -> bool:
+        """Adiciona uma mensagem com ID ao buffer.
+
+        Se `timer_job_id` for informado, registra também o job do timer no mesmo round-trip.
+        Retorna True se a mensagem (e o timer) foram gravados no Redis.
+        """
+        client = await cls._get_redis_client()
+        if client:
+            # Textos ficam em um hash indexado pelo ID e a ordem de chegada em uma lista
+            field = message_id or uuid.uuid4().hex
+            phone_key = phone.encode()
+            messages_key = _BUFFER_MESSAGES_PREFIX + phone_key
+            order_key = _BUFFER_ORDER_PREFIX + phone_key
+            try:
+                # Tudo no mesmo pacote: um único round-trip por mensagem recebida
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.hset(messages_key, field, message_text)
+                    pipe.rpush(order_key, field)
+                    pipe.expire(messages_key, _BUFFER_TTL)
+                    pipe.expire(order_key, _BUFFER_TTL)
+                    if timer_job_id:
+                        pipe.set(_BUFFER_TIMER_PREFIX + phone_key, timer_job_id, ex=timer_ttl)
+                    await pipe.execute()
+                cls._on_redis_success()
+                return True
+            except _REDIS_ERRORS as e:
+                cls._on_redis_error(e)
+        ids, texts = cls._message_buffer_cache.setdefault(phone, (deque(), deque()))
+        ids.append(message_id)
+        texts.append(message_text)
+        return False
 
     @classmethod
     async def update_message_in_buffer(cls, phone: str, message_id: str, new_message_text: str):
         """Atualiza o texto de uma mensagem existente no buffer."""
-        client = await cls._get_redis_client() if settings.is_redis_enabled else None
-        if client:
-            key = f"buffer:{phone}"
-            messages_json = await client.lrange(key, 0, -1)
-            for i, msg_json in enumerate(messages_json):
-                msg = json.loads(msg_json)
-                if msg.get('id') == message_id:
-                    msg['text'] = new_message_text
-                    await client.lset(key, i, json.dumps(msg))
+        client = await cls._get_redis_client()
+        if client:
+            if not message_id:
+                return
+            try:
+                # HSET condicional (só se o ID já estiver no buffer), sem ler o buffer inteiro
+                updated = await cls._buffer_update_script(
+                    keys=[_BUFFER_MESSAGES_PREFIX + phone.encode()], args=[message_id, new_message_text]
+                )
+                cls._on_redis_success()
+            except _REDIS_ERRORS as e:
+                cls._on_redis_error(e)
+            else:
+                if updated:
                     logger.info(f"Mensagem {message_id} atualizada no Redis para {phone}.")
-                    break
-        else:  # fallback
-            if phone in cls._message_buffer_cache:
-                for msg in cls._message_buffer_cache[phone]:
-                    if msg.get('id') == message_id:
-                        msg['text'] = new_message_text
-                        logger.info(f"Mensagem {message_id} atualizada no cache em memória para {phone}.")
-                        break
+                return
+        # fallback
+        if phone in cls._message_buffer_cache:
+            ids, texts = cls._message_buffer_cache[phone]
+            try:
+                index = ids.index(message_id)
+            except ValueError:
+                return
+            texts[index] = new_message_text
+            logger.info(f"Mensagem {message_id} atualizada no cache em memória para {phone}.")
     
     @classmethod
     async def get_and_clear_buffer(cls, phone: str) -> str:
@@ -222,30 +648,34 @@ class CacheService:
         - Usa quebra de linha entre entradas distintas para preservar intenção do usuário
         - Garante pontuação quando necessário
         """
-        client = await cls._get_redis_client() if settings.is_redis_enabled else None
+        client = await cls._get_redis_client()
         
         texts = []
         if client:
-            key = f"buffer:{phone}"
-            messages_json = await client.lrange(key, 0, -1)
-            await client.delete(key)
-            texts = [json.loads(msg_json).get('text', '') for msg_json in messages_json if msg_json]
-        else:
-            messages_obj = cls._message_buffer_cache.pop(phone, [])
-            texts = [msg.get('text', '') for msg in messages_obj]
+            phone_key = phone.encode()
+            try:
+                # Leitura e remoção atômicas em um único round-trip: uma mensagem que chegue
+                # durante o flush não é apagada sem ter sido lida
+                messages = await cls._buffer_drain_script(
+                    keys=[_BUFFER_ORDER_PREFIX + phone_key, _BUFFER_MESSAGES_PREFIX + phone_key]
+                )
+                texts = [msg.decode() for msg in messages]
+                cls._on_redis_success()
+            except _REDIS_ERRORS as e:
+                cls._on_redis_error(e)
+        # Junta também o que tiver caído no fallback em memória enquanto o Redis estava fora
+        _, buffered_texts = cls._message_buffer_cache.pop(phone, (None, ()))
+        texts.extend(buffered_texts)
 
         if not texts:
             return ""
 
         # Estratégia: concatenar todas as entradas em uma única linha; se não houver
         # pontuação ao fim de uma entrada, adiciona ponto final antes do espaço.
-        normalized_parts = []
-        for text in texts:
-            cleaned_text = (text or "").strip()
-            if not cleaned_text:
-                continue
-            if cleaned_text and cleaned_text[-1] not in ".?!":
-                cleaned_text = cleaned_text + "."
-            normalized_parts.append(cleaned_text)
-
-        return " ".join(normalized_parts).strip()
\ No newline at end of file
+        # As entradas são unidas por um separador interno e a pontuação é corrigida
+        # com uma única passada de regex sobre o texto inteiro.
+        normalized_parts = [cleaned for text in texts if (cleaned := (text or "").strip())]
+        if not normalized_parts:
+            return ""
+        joined = _BUFFER_PART_SEPARATOR.join(normalized_parts)
+        return _MISSING_END_PUNCT.sub(".", joined).replace(_BUFFER_PART_SEPARATOR, " ")
\ No newline at end of file
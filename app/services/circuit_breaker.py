@@ -0,0 +1,40 @@
+import time
+from typing import Optional
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker mínimo: fechado → aberto (após `threshold` falhas seguidas) → meio-aberto.
+
+    Enquanto aberto, os chamadores devem desistir na hora (ou usar um fallback) em vez de
+    gastar o timeout inteiro de um serviço fora do ar. Passado o `reset_timeout`, a próxima
+    chamada testa o serviço de novo: sucesso fecha o circuito, falha o reabre.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def is_closed(self) -> bool:
+        return self.opened_at is None
+
+    @property
+    def is_open(self) -> bool:
+        # Passado o reset_timeout o circuito fica meio-aberto e a próxima chamada testa o serviço
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def trip(self):
+        self.failures = max(self.failures, self.threshold)
+        self.opened_at = time.monotonic()
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
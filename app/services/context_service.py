@@ -1,12 +1,17 @@
 # app/services/context_service.py
 import logging
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict, Optional
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+from cachetools import TTLCache
 from app.services.cache_service import CacheService
 
 logger = logging.getLogger(__name__)
 
+# Janela após uma mensagem do sistema em que a resposta do cliente recebe delay de contexto
+_CONTEXT_DELAY_SECONDS = 5 * 60
+
 class ContextService:
     """
     Serviço para gerenciar o contexto das conversas e evitar perda de contexto.
@@ -26,8 +31,14 @@ class ContextService:
     - Preserva histórico de conversas por telefone
     """
     
-    # Cache para armazenar o último contexto por telefone
-    _context_cache: Dict[str, dict] = {}
+    # Cache local do último contexto por telefone. Limitado em tamanho e com TTL igual
+    # à janela do delay de contexto: depois disso a entrada não muda mais a decisão
+    # e, se necessário, é relida do cache persistente.
+    _context_cache: TTLCache = TTLCache(maxsize=10_000, ttl=_CONTEXT_DELAY_SECONDS)
+    # Telefones sem contexto no cache persistente (evita um round-trip ao Redis por mensagem
+    # de leads que nunca receberam mensagem do sistema). O TTL curto limita a defasagem
+    # quando a marcação é feita por outro worker.
+    _no_context_cache: TTLCache = TTLCache(maxsize=50_000, ttl=60)
     
     @staticmethod
     async def mark_system_message_sent(phone: str, message_type: str = "system"):
@@ -49,22 +60,58 @@ class ContextService:
                 - "test_notification": Notificações de teste
                 - "system": Mensagens genéricas do sistema
         """
-        timestamp = datetime.now()
-        
+        # Epoch (float): gravado como número e comparado direto em should_use_context_delay
         context_data = {
-            "last_system_message": timestamp.isoformat(),
+            "ts": time.time(),
             "message_type": message_type,
             "phone": phone
         }
         
         # Armazena no cache local
         ContextService._context_cache[phone] = context_data
+        ContextService._no_context_cache.pop(phone, None)
         
         # Armazena no cache persistente
         await CacheService.set_context_data(phone, context_data)
         
         logger.info(f"📝 Contexto marcado para {phone}: {message_type}")
     
+    @staticmethod
+    async def mark_system_messages_sent(batch: List[Tuple[str, str]], force: bool = False):
+        """
+        Versão em lote de `mark_system_message_sent`, para envios em massa
+        (lembretes, notificações): todas as marcações vão ao Redis em um único pipeline.
+        
+        Por padrão a marcação só é regravada se o telefone não tiver outra dentro da
+        janela de 5 minutos (deduplicada por uma chave curta no Redis), evitando reescritas
+        a cada mensagem de uma mesma rajada.
+        
+        Args:
+            batch: Lista de tuplas (telefone, tipo da mensagem)
+            force: Se True, sempre sobrescreve a marcação existente
+        """
+        timestamp = time.time()
+        
+        contexts = {
+            phone: {
+                "ts": timestamp,
+                "message_type": message_type,
+                "phone": phone
+            }
+            for phone, message_type in batch
+        }
+        
+        for phone in contexts:
+            ContextService._no_context_cache.pop(phone, None)
+        # O cache local recebe só o que foi gravado, para não divergir do Redis (lido pelos
+        # outros workers); telefones deduplicados são relidos do cache persistente
+        written = await CacheService.set_context_data_many(contexts, dedupe=not force)
+        for phone in contexts.keys() - written.keys():
+            ContextService._context_cache.pop(phone, None)
+        ContextService._context_cache.update(written)
+        
+        logger.info(f"📝 Contexto marcado para {len(written)} de {len(contexts)} telefones")
+    
     @staticmethod
     async def should_use_context_delay(phone: str) -> bool:
         """
@@ -90,25 +137,38 @@ class ContextService:
         context_data = ContextService._context_cache.get(phone)
         
         if not context_data:
+            # Ausência de contexto já confirmada há pouco: não consulta o Redis de novo
+            if phone in ContextService._no_context_cache:
+                return False
             # Tenta buscar do cache persistente
             context_data = await CacheService.get_context_data(phone)
             if context_data:
                 ContextService._context_cache[phone] = context_data
+            else:
+                ContextService._no_context_cache[phone] = True
         
         if not context_data:
             return False
         
+        # Entradas antigas (data em ISO, sem "ts") são convertidas uma única vez e ficam no cache local
+        last_message_ts = context_data.get("ts")
+        if last_message_ts is None:
+            last_system_message = context_data.get("last_system_message")
+            if not last_system_message:
+                return False
+            last_message_ts = datetime.fromisoformat(last_system_message).timestamp()
+            context_data["ts"] = last_message_ts
+        
         # Verifica se a última mensagem do sistema foi enviada há menos de 5 minutos
-        last_message_time = datetime.fromisoformat(context_data["last_system_message"])
-        time_diff = datetime.now() - last_message_time
+        elapsed = time.time() - last_message_ts
         
         # Se foi enviada há menos de 5 minutos, usa delay de contexto
-        should_delay = time_diff < timedelta(minutes=5)
+        should_delay = elapsed < _CONTEXT_DELAY_SECONDS
         
         if should_delay:
-            logger.info(f"⏰ Usando delay de contexto para {phone} (última mensagem do sistema há {time_diff.total_seconds():.0f}s)")
+            logger.info(f"⏰ Usando delay de contexto para {phone} (última mensagem do sistema há {elapsed:.0f}s)")
         else:
-            logger.info(f"✅ Sem delay de contexto para {phone} (última mensagem do sistema há {time_diff.total_seconds():.0f}s)")
+            logger.info(f"✅ Sem delay de contexto para {phone} (última mensagem do sistema há {elapsed:.0f}s)")
         
         return should_delay
     
@@ -121,6 +181,7 @@ class ContextService:
             phone: Número do telefone
         """
         ContextService._context_cache.pop(phone, None)
+        ContextService._no_context_cache[phone] = True
         await CacheService.clear_context_data(phone)
         logger.info(f"🧹 Contexto limpo para {phone}")
     
@@ -1,10 +1,31 @@
 import os
+import asyncio
+import hashlib
 import logging
-import requests
+from typing import Optional
+import aiohttp
+import orjson
 from app.config.settings import Settings
+from app.services.cache_service import CacheService
+from app.services.circuit_breaker import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+# Sessão HTTP compartilhada (keep-alive com a API da ElevenLabs), criada sob demanda
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+        )
+    return _session
+
+# Após falhas seguidas da ElevenLabs, desiste na hora por alguns segundos
+_breaker = CircuitBreaker(threshold=5, reset_timeout=30.0)
+
 class ElevenLabsService:
     def __init__(self):
         settings = Settings()
@@ -20,8 +41,33 @@ class ElevenLabsService:
             "use_speaker_boost": True,  # Melhora clareza e consistência
             "speed": 1.10              # Velocidade da fala (0.25-4.0) 
         }
+        
+        self.url = f"https://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}"
+        self.headers = {
+            "Accept": "audio/mpeg",
+            "Content-Type": "application/json",
+            "xi-api-key": self.api_key
+        }
+        
+        # Payload com configurações otimizadas, serializado uma única vez sem o "}" final:
+        # a cada chamada só o texto é serializado e concatenado
+        self._payload_prefix = orjson.dumps({
+            "model_id": self.model_id,
+            "voice_settings": self.voice_settings,
+            "optimize_streaming_latency": 0,  # Prioriza qualidade
+            "output_format": "mp3_44100_128",  # Qualidade consistente
+            "apply_text_normalization": "auto"  # Normalização automática
+        })[:-1]
+
+    @staticmethod
+    async def close():
+        """Fecha a sessão HTTP compartilhada (chamado no shutdown da aplicação)."""
+        global _session
+        if _session is not None and not _session.closed:
+            await _session.close()
+        _session = None
 
-    def generate_audio(self, text: str) -> bytes:
+    async def generate_audio(self, text: str) -> bytes:
         """
         Gera resposta em áudio usando ElevenLabs API REST, otimizado para português brasileiro.
         Configurado para velocidade mais rápida e volume consistente.
@@ -32,36 +78,46 @@ class ElevenLabsService:
         Returns:
             bytes: Áudio em formato MP3
         """
+        # Frases repetidas do script de vendas reaproveitam o áudio já gerado. A chave cobre
+        # voz, modelo e configurações (o prefixo serializado do payload) além do texto.
+        cache_key = hashlib.blake2b(
+            self.voice_id.encode() + b"|" + self._payload_prefix + b"|" + text.encode(),
+            digest_size=16,
+        ).hexdigest()
+        cached_audio = await CacheService.get_tts_audio(cache_key)
+        if cached_audio:
+            logger.info("Áudio reaproveitado do cache")
+            return cached_audio
+
+        if _breaker.is_open:
+            logger.warning("⚠️ ElevenLabs indisponível (circuito aberto). Áudio não gerado.")
+            raise Exception("ElevenLabs indisponível (circuito aberto)")
+
         try:
             logger.info(f"Gerando áudio com ElevenLabs (velocidade: {self.voice_settings['speed']}x)")
             
-            url = f"https://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}"
-            
-            headers = {
-                "Accept": "audio/mpeg",
-                "Content-Type": "application/json",
-                "xi-api-key": self.api_key
-            }
-
-            # Payload com configurações otimizadas
-            data = {
-                "text": text,
-                "model_id": self.model_id,
-                "voice_settings": self.voice_settings,
-                "optimize_streaming_latency": 0,  # Prioriza qualidade
-                "output_format": "mp3_44100_128",  # Qualidade consistente
-                "apply_text_normalization": "auto"  # Normalização automática
-            }
+            body = self._payload_prefix + b',"text":' + orjson.dumps(text) + b'}'
 
-            response = requests.post(url, json=data, headers=headers)
-            
-            if response.status_code != 200:
-                logger.error(f"ElevenLabs API error: {response.text}")
-                raise Exception(f"ElevenLabs API error: {response.text}")
+            async with _get_session().post(self.url, data=body, headers=self.headers) as response:
+                if response.status != 200:
+                    # Erros 5xx indicam serviço fora do ar; 4xx são problemas da requisição
+                    if response.status >= 500:
+                        _breaker.record_failure()
+                    error_text = await response.text()
+                    logger.error(f"ElevenLabs API error: {error_text}")
+                    raise Exception(f"ElevenLabs API error: {error_text}")
+                
+                audio = await response.read()
                 
+            _breaker.record_success()
             logger.info("Áudio gerado com sucesso (velocidade otimizada)")
-            return response.content
+            await CacheService.set_tts_audio(cache_key, audio)
+            return audio
             
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            _breaker.record_failure()
+            logger.error(f"Erro ao gerar áudio: {str(e)}")
+            raise
         except Exception as e:
             logger.error(f"Erro ao gerar áudio: {str(e)}")
             raise 
\ No newline at end of file
@@ -1,10 +1,42 @@
+import asyncio
 import logging
+from typing import Optional
 import aiohttp
+from cachetools import TTLCache
 from app.config.settings import Settings
+from app.services.circuit_breaker import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+# Sessão HTTP compartilhada (keep-alive com a Zaia), criada sob demanda
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, keepalive_timeout=60)
+        )
+    return _session
+
+# Intenções já detectadas, por (mensagem normalizada, chat_id): mensagens curtas e repetidas
+# ("quanto custa", "sim", "ok") são muito comuns no funil e não precisam ir à Zaia de novo
+_intent_cache: TTLCache = TTLCache(maxsize=5_000, ttl=3600)
+_INTENT_CACHE_KEY_LENGTH = 200
+
+# Após falhas seguidas da Zaia, responde "unknown" na hora por alguns segundos
+_breaker = CircuitBreaker(threshold=5, reset_timeout=30.0)
+
 class IntentService:
+    @staticmethod
+    async def close():
+        """Fecha a sessão HTTP compartilhada (chamado no shutdown da aplicação)."""
+        global _session
+        if _session is not None and not _session.closed:
+            await _session.close()
+        _session = None
+
     @staticmethod
     async def detect_intent(message: str, chat_id: str = None) -> str:
         """
@@ -17,6 +49,16 @@ class IntentService:
         Returns:
             str: Nome da intenção detectada (ex: "reenviar_boleto", "ajuda_prova_flexge", "duvida_gramatical")
         """
+        cache_key = (message.strip().lower()[:_INTENT_CACHE_KEY_LENGTH], chat_id)
+        cached_intent = _intent_cache.get(cache_key)
+        if cached_intent is not None:
+            logger.info(f"Intenção em cache: {cached_intent}")
+            return cached_intent
+
+        if _breaker.is_open:
+            logger.warning("⚠️ Zaia indisponível (circuito aberto). Intenção não detectada.")
+            return "unknown"
+
         try:
             settings = Settings()
             # A URL específica para detecção de intenção (ajuste conforme documentação da Zaia)
@@ -37,18 +79,28 @@ class IntentService:
                 payload["chat_id"] = chat_id
             
             logger.info(f"Detectando intenção para mensagem: {message}")
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        intent = data.get('intent', 'unknown')
-                        logger.info(f"Intenção detectada: {intent}")
-                        return intent
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Erro ao detectar intenção: Status={response.status}, Response={error_text}")
-                        return "unknown"
+            async with _get_session().post(url, headers=headers, json=payload) as response:
+                if response.status >= 500:
+                    _breaker.record_failure()
+                else:
+                    _breaker.record_success()
+                if response.status == 200:
+                    data = await response.json()
+                    intent = data.get('intent', 'unknown')
+                    logger.info(f"Intenção detectada: {intent}")
+                    # "unknown" não é guardado para uma falha momentânea não ficar em cache
+                    if intent != "unknown":
+                        _intent_cache[cache_key] = intent
+                    return intent
+                else:
+                    error_text = await response.text()
+                    logger.error(f"Erro ao detectar intenção: Status={response.status}, Response={error_text}")
+                    return "unknown"
                         
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            _breaker.record_failure()
+            logger.error(f"Erro ao detectar intenção: {str(e)}")
+            return "unknown"
         except Exception as e:
             logger.error(f"Erro ao detectar intenção: {str(e)}")
             return "unknown" 
\ No newline at end of file
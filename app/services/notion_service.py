@@ -1,11 +1,109 @@
+import asyncio
 import logging
-import requests
-import time
-import random
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+import httpx
+import orjson
+from cachetools import TTLCache
 from app.config.settings import Settings
+from app.services.cache_service import CacheService
+from app.services.circuit_breaker import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+# Cliente HTTP compartilhado por todas as instâncias: conexões (HTTP/2) reaproveitadas com a API do Notion
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=32),
+        )
+    return _client
+
+# Após falhas seguidas do Notion, as chamadas desistem na hora por alguns segundos
+_breaker = CircuitBreaker(threshold=5, reset_timeout=30.0)
+
+# Respostas repetidas com backoff exponencial: limite de taxa do Notion (3 req/s) e falhas transitórias
+_RETRY_STATUSES = {429, 502, 503, 504}
+_MAX_RETRIES = 3
+_RETRY_BACKOFF = 0.3
+
+# Consultas que só precisam do ID da página pedem apenas o título (menor resposta possível)
+_ID_ONLY_PROPERTIES = ("title",)
+
+# Cópia local (por worker) do mapeamento telefone → página, na frente do cache no Redis:
+# chamadas seguidas para o mesmo lead no mesmo fluxo não pagam nem o round-trip ao Redis
+_page_id_cache: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+
+# Travas por telefone: serializam a busca + criação do lead dentro do worker. Cada entrada
+# conta quem está usando a trava e sai do dicionário quando o último a libera
+_create_locks: Dict[str, list] = {}
+
+# Quando outro worker já reservou a criação do lead, aguarda o ID dele aparecer no cache.
+# Se não aparecer, não cria outra página: as atualizações enfileiradas a encontram depois
+_CREATE_WAIT_ATTEMPTS = 10
+_CREATE_WAIT_INTERVAL = 0.2
+
+
+@asynccontextmanager
+async def _create_lock(phone: str):
+    """Trava local de criação do lead; a entrada é removida quando ninguém mais a usa."""
+    entry = _create_locks.get(phone)
+    if entry is None:
+        entry = _create_locks[phone] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _create_locks[phone]
+
+
+# Atualizações de propriedades enfileiradas por telefone: as que chegam dentro da janela
+# são combinadas em um único PATCH (ou enviadas na hora ao acumular muitas propriedades)
+_pending_updates: Dict[str, dict] = {}
+_flush_tasks: Dict[str, asyncio.Task] = {}
+_UPDATE_DEBOUNCE_SECONDS = 0.2
+_UPDATE_FLUSH_MAX_KEYS = 10
+
+# Conversores por tipo de propriedade do Notion (valor simples ou None para ignorar).
+# Adicione outros tipos se necessário.
+_PROPERTY_PARSERS = {
+    'title': lambda prop: prop['title'][0]['text']['content'] if prop['title'] else None,
+    'rich_text': lambda prop: prop['rich_text'][0]['text']['content'] if prop['rich_text'] else None,
+    'email': lambda prop: prop['email'] or None,
+    'checkbox': lambda prop: prop.get('checkbox', False),
+    # Propriedade do tipo Status (novo Notion). Ex.: { status: { name: "Agendado Reunião" } }
+    'status': lambda prop: (prop.get('status') or {}).get('name') or None,
+    # Fallback para bancos que usam select em vez de status
+    'select': lambda prop: (prop.get('select') or {}).get('name') or None,
+    # Mantém como lista de nomes
+    'multi_select': lambda prop: [opt.get('name') for opt in prop['multi_select'] if opt.get('name')] if prop.get('multi_select') else None,
+    'url': lambda prop: prop.get('url') or None,
+    'phone_number': lambda prop: prop.get('phone_number') or None,
+}
+
+# Formatadores dos valores enviados ao Notion, por nome de propriedade.
+# Para outros campos, assume rich_text (incluindo Primeira Mensagem).
+def _format_rich_text(value) -> dict:
+    return {"rich_text": [{"text": {"content": str(value)}}]}
+
+_PROPERTY_FORMATTERS = {
+    'Cliente': lambda value: {"title": [{"text": {"content": str(value)}}]},
+    'Status': lambda value: {"status": {"name": str(value)}},
+    'Nível de Qualificação': lambda value: {"multi_select": [{"name": str(value)}]},
+    'Link Rápido WhatsApp': lambda value: {"url": str(value)},
+    'Alerta Enviado': lambda value: {"checkbox": bool(value)},
+    'Aguardando Confirmação Nome': lambda value: {"checkbox": bool(value)},
+}
+
 class NotionService:
     def __init__(self):
         settings = Settings()
@@ -18,70 +116,139 @@ class NotionService:
             "Notion-Version": "2022-06-28",
         }
 
-    def _find_page_by_phone(self, phone: str) -> str or None:
-        """Busca uma página no Notion pelo número de telefone."""
+    @staticmethod
+    async def close():
+        """Envia as atualizações pendentes e fecha o cliente HTTP compartilhado (chamado no shutdown da aplicação)."""
+        global _client
+        for task in _flush_tasks.values():
+            task.cancel()
+        _flush_tasks.clear()
+        if _pending_updates:
+            service = NotionService()
+            await asyncio.gather(
+                *(service._flush_pending_updates(phone) for phone in list(_pending_updates)),
+                return_exceptions=True,
+            )
+        if _client is not None and not _client.is_closed:
+            await _client.aclose()
+        _client = None
+
+    def _is_unavailable(self, phone: str) -> bool:
+        """True se o circuito estiver aberto (Notion falhando): a chamada deve desistir na hora."""
+        if _breaker.is_open:
+            logger.warning(f"⚠️ Notion indisponível (circuito aberto). Pulando operação para {phone}.")
+            return True
+        return False
+
+    async def _request(self, method: str, url: str, payload: dict = None, params=None) -> httpx.Response:
+        """Executa uma chamada à API do Notion, alimentando o circuit breaker."""
+        content = orjson.dumps(payload) if payload is not None else None
+        for attempt in range(_MAX_RETRIES + 1):
+            try:
+                response = await _get_client().request(method, url, headers=self.headers, content=content, params=params)
+            except httpx.TransportError:
+                _breaker.record_failure()
+                raise
+            if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+                break
+            # Respeita o Retry-After do Notion quando presente
+            retry_after = response.headers.get("retry-after", "")
+            delay = float(retry_after) if retry_after.isdigit() else _RETRY_BACKOFF * (2 ** attempt)
+            logger.warning(f"⚠️ Notion respondeu {response.status_code}; nova tentativa em {delay:.1f}s")
+            await asyncio.sleep(delay)
+        # Erros 5xx indicam serviço fora do ar; 4xx são problemas da requisição
+        if response.status_code >= 500:
+            _breaker.record_failure()
+        else:
+            _breaker.record_success()
+        return response
+
+    async def _remember_page_id(self, phone: str, page_id: str):
+        _page_id_cache[phone] = page_id
+        await CacheService.set_notion_page_id(phone, page_id)
+
+    async def invalidate(self, phone: str):
+        """Descarta o ID de página em cache (local e Redis); a próxima chamada refaz a busca."""
+        _page_id_cache.pop(phone, None)
+        await CacheService.clear_notion_page_id(phone)
+
+    async def _cached_page_id(self, phone: str) -> Optional[str]:
+        """ID da página em cache (local ou Redis), sem chamar o Notion."""
+        page_id = _page_id_cache.get(phone)
+        if page_id:
+            return page_id
+        page_id = await CacheService.get_notion_page_id(phone)
+        if page_id:
+            _page_id_cache[phone] = page_id
+        return page_id
+
+    async def _find_page_by_phone_full(self, phone: str, filter_properties: tuple = None) -> dict or None:
+        """
+        Busca no Notion a página do lead pelo telefone e retorna o objeto completo
+        (id, url e properties) do primeiro resultado. O ID encontrado fica em cache.
+        'filter_properties' limita as propriedades devolvidas (IDs de propriedade do Notion).
+        """
+        if self._is_unavailable(phone):
+            return None
         try:
             url = f"{self.api_url}/databases/{self.database_id}/query"
-            query = {"filter": {"property": "Telefone", "rich_text": {"equals": phone}}}
-            response = requests.post(url, headers=self.headers, json=query)
+            query = {"filter": {"property": "Telefone", "rich_text": {"equals": phone}}, "page_size": 1}
+            # filter_properties é parâmetro de URL na API do Notion (repetido por propriedade)
+            params = [("filter_properties", prop_id) for prop_id in filter_properties] if filter_properties else None
+            response = await self._request("POST", url, query, params=params)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             if data["results"]:
-                return data["results"][0]["id"]
+                page = data["results"][0]
+                await self._remember_page_id(phone, page["id"])
+                return page
             return None
         except Exception as e:
             error_message = f"Erro ao buscar página no Notion por telefone {phone}: {e}"
             logger.error(error_message)
-            print(f"[NOTION_SERVICE_ERROR] {error_message}") # Print para depuração
             return None
 
+    async def _find_page_by_phone(self, phone: str) -> str or None:
+        """Busca uma página no Notion pelo número de telefone (o ID encontrado fica em cache)."""
+        page_id = await self._cached_page_id(phone)
+        if page_id:
+            return page_id
+        # Só o ID interessa aqui: pede apenas o título, que no Notion tem sempre o ID "title"
+        page = await self._find_page_by_phone_full(phone, filter_properties=_ID_ONLY_PROPERTIES)
+        return page["id"] if page else None
+
     def _parse_properties(self, notion_props: dict) -> dict:
         """Converte as propriedades do Notion para um dicionário simples."""
         data = {}
         for name, prop in notion_props.items():
-            prop_type = prop['type']
-            if prop_type == 'title' and prop['title']:
-                data[name] = prop['title'][0]['text']['content']
-            elif prop_type == 'rich_text' and prop['rich_text']:
-                data[name] = prop['rich_text'][0]['text']['content']
-            elif prop_type == 'email' and prop['email']:
-                data[name] = prop['email']
-            elif prop_type == 'checkbox':
-                data[name] = prop.get('checkbox', False)
-            elif prop_type == 'status' and prop.get('status'):
-                # Propriedade do tipo Status (novo Notion). Ex.: { status: { name: "Agendado Reunião" } }
-                status_obj = prop.get('status') or {}
-                status_name = status_obj.get('name')
-                if status_name:
-                    data[name] = status_name
-            elif prop_type == 'select' and prop.get('select'):
-                # Fallback para bancos que usam select em vez de status
-                select_obj = prop.get('select') or {}
-                select_name = select_obj.get('name')
-                if select_name:
-                    data[name] = select_name
-            elif prop_type == 'multi_select' and prop.get('multi_select'):
-                # Mantém como lista de nomes
-                options = prop.get('multi_select') or []
-                data[name] = [opt.get('name') for opt in options if opt.get('name')]
-            elif prop_type == 'url' and prop.get('url'):
-                data[name] = prop.get('url')
-            elif prop_type == 'phone_number' and prop.get('phone_number'):
-                data[name] = prop.get('phone_number')
-            # Adicione outros tipos se necessário
+            parser = _PROPERTY_PARSERS.get(prop['type'])
+            if parser is None:
+                continue
+            value = parser(prop)
+            if value is not None:
+                data[name] = value
         return data
 
-    def get_lead_data_by_phone(self, phone: str) -> dict or None:
+    async def get_lead_data_by_phone(self, phone: str) -> dict or None:
         """Busca os dados de um lead pelo telefone e retorna um dicionário com propriedades e URL."""
-        page_id = self._find_page_by_phone(phone)
-        if not page_id:
+        if self._is_unavailable(phone):
             return None
-        
         try:
-            url = f"{self.api_url}/pages/{page_id}"
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            page_data = response.json()
+            # Sem ID em cache, a própria consulta ao banco já traz as propriedades da página;
+            # com ID em cache, basta um GET da página. Nos dois casos, uma única chamada.
+            page_id = await self._cached_page_id(phone)
+            if page_id:
+                response = await self._request("GET", f"{self.api_url}/pages/{page_id}")
+                response.raise_for_status()
+                page_data = orjson.loads(response.content)
+                # Página arquivada ou na lixeira: o ID em cache não vale mais, refaz a busca
+                if page_data.get("archived") or page_data.get("in_trash"):
+                    await self.invalidate(phone)
+                    page_id = None
+            if not page_id:
+                page_data = await self._find_page_by_phone_full(phone)
+                if not page_data:
+                    return None
             
             # Estrutura o retorno para incluir propriedades e a URL da página
             parsed_data = {
@@ -92,12 +259,13 @@ class NotionService:
         except Exception as e:
             error_message = f"Erro ao buscar dados do lead {phone} no Notion: {e}"
             logger.error(error_message)
-            print(f"[NOTION_SERVICE_ERROR] {error_message}")
+            # O ID em cache pode apontar para uma página removida; a próxima chamada refaz a busca
+            await self.invalidate(phone)
             return None
 
-    def create_or_update_lead(self, sender_name: str, phone: str, photo_url: str = None, first_message: str = None) -> bool:
+    async def create_or_update_lead(self, sender_name: str, phone: str, photo_url: str = None, first_message: str = None) -> bool:
         """
-        Cria ou atualiza um lead no Notion, com lógica de dupla verificação
+        Cria ou atualiza um lead no Notion, com trava por telefone (no worker e no Redis)
         para prevenir duplicatas por condição de corrida.
         Adiciona a primeira mensagem do lead se fornecida.
         Retorna True se um novo lead foi criado, False se foi atualizado.
@@ -105,16 +273,39 @@ class NotionService:
         if not self.api_key or not self.database_id:
             logger.warning("Credenciais do Notion não configuradas. Serviço desabilitado.")
             return False
+        if self._is_unavailable(phone):
+            return False
 
-        page_id = self._find_page_by_phone(phone)
-
-        # Lógica de dupla verificação para evitar race conditions
-        if not page_id:
-            time.sleep(random.uniform(0.5, 1.5)) # Pausa aleatória para dessincronizar processos
-            page_id = self._find_page_by_phone(phone) # Verifica novamente
+        # A trava local cobre mensagens simultâneas no mesmo worker; entre workers, só quem
+        # conseguir a reserva no Redis cria a página e os demais esperam o ID dela
+        async with _create_lock(phone):
+            page_id = await self._find_page_by_phone(phone)
+            claimed = False
+            if not page_id:
+                claimed = await CacheService.claim_notion_page_creation(phone)
+                if not claimed:
+                    page_id = await self._wait_for_page_creation(phone)
+                    if not page_id:
+                        logger.info(f"Lead {phone} ainda em criação por outro worker. Criação ignorada.")
+                        return False
+            try:
+                await self._upsert_lead(page_id, sender_name, phone, photo_url, first_message)
+            finally:
+                if claimed:
+                    await CacheService.release_notion_page_creation(phone)
+        return claimed
 
-        is_new_lead = not bool(page_id)
+    async def _wait_for_page_creation(self, phone: str) -> Optional[str]:
+        """Aguarda o ID da página criada por outro worker; por fim, consulta o Notion."""
+        for _ in range(_CREATE_WAIT_ATTEMPTS):
+            await asyncio.sleep(_CREATE_WAIT_INTERVAL)
+            page_id = await self._cached_page_id(phone)
+            if page_id:
+                return page_id
+        return await self._find_page_by_phone(phone)
 
+    async def _upsert_lead(self, page_id: Optional[str], sender_name: str, phone: str, photo_url: str, first_message: str):
+        """Atualiza a página existente (page_id) ou cria uma nova com os dados básicos do lead."""
         properties = {
             "Cliente": {"title": [{"text": {"content": sender_name}}]},
             "Telefone": {"rich_text": [{"text": {"content": phone}}]},
@@ -136,13 +327,13 @@ class NotionService:
             logger.info(f"Lead com telefone {phone} já existe. Atualizando dados básicos e foto.")
             update_url = f"{self.api_url}/pages/{page_id}"
             try:
-                response = requests.patch(update_url, headers=self.headers, json=payload)
+                response = await self._request("PATCH", update_url, payload)
                 response.raise_for_status()
                 logger.info(f"Página do lead {phone} atualizada com sucesso.")
             except Exception as e:
                 error_message = f"Erro ao atualizar página no Notion para o lead {phone}: {e.response.text if hasattr(e, 'response') else str(e)}"
                 logger.error(error_message)
-                print(f"[NOTION_SERVICE_ERROR] {error_message}")
+                await self.invalidate(phone)
         else:
             logger.info(f"Criando novo lead no Notion para {phone} com dados básicos e foto.")
             create_url = f"{self.api_url}/pages"
@@ -153,17 +344,15 @@ class NotionService:
                 **payload
             }
             try:
-                response = requests.post(create_url, headers=self.headers, json=full_payload)
+                response = await self._request("POST", create_url, full_payload)
                 response.raise_for_status()
                 logger.info(f"Novo lead {phone} criado no Notion com sucesso.")
+                await self._remember_page_id(phone, orjson.loads(response.content)["id"])
             except Exception as e:
                 error_message = f"Erro ao criar página no Notion para o lead {phone}: {e.response.text if hasattr(e, 'response') else str(e)}"
                 logger.error(error_message)
-                print(f"[NOTION_SERVICE_ERROR] {error_message}")
-        
-        return is_new_lead
 
-    def update_lead_properties(self, phone: str, updates: dict):
+    async def update_lead_properties(self, phone: str, updates: dict):
         """
         Atualiza as propriedades de um lead (ex: profissão, motivação, status).
         'updates' deve ser um dicionário como {'Profissão': 'Engenheiro', 'Status': 'Qualificado'}
@@ -171,8 +360,10 @@ class NotionService:
         if not self.api_key or not self.database_id:
             logger.warning("Credenciais do Notion não configuradas. Serviço desabilitado.")
             return
+        if self._is_unavailable(phone):
+            return
 
-        page_id = self._find_page_by_phone(phone)
+        page_id = await self._find_page_by_phone(phone)
         if not page_id:
             logger.warning(f"Não foi possível encontrar lead com telefone {phone} para atualizar.")
             return
@@ -183,19 +374,7 @@ class NotionService:
                 continue
             
             # Formatação baseada no nome da propriedade
-            if key == 'Cliente':
-                properties[key] = {"title": [{"text": {"content": str(value)}}]}
-            elif key == 'Status':
-                properties[key] = {"status": {"name": str(value)}}
-            elif key == 'Nível de Qualificação':
-                properties[key] = {"multi_select": [{"name": str(value)}]}
-            elif key == 'Link Rápido WhatsApp':
-                properties[key] = {"url": str(value)}
-            elif key == 'Alerta Enviado' or key == 'Aguardando Confirmação Nome':
-                properties[key] = {"checkbox": bool(value)}
-            # Para outros campos, assume rich_text (incluindo Primeira Mensagem)
-            else:
-                properties[key] = {"rich_text": [{"text": {"content": str(value)}}]}
+            properties[key] = _PROPERTY_FORMATTERS.get(key, _format_rich_text)(value)
 
         if not properties:
             logger.info("Nenhuma propriedade para atualizar.")
@@ -205,7 +384,7 @@ class NotionService:
         payload = {"properties": properties}
 
         try:
-            response = requests.patch(update_url, headers=self.headers, json=payload)
+            response = await self._request("PATCH", update_url, payload)
             response.raise_for_status()
             logger.info(f"Propriedades do lead {phone} atualizadas com sucesso.")
         except Exception as e:
@@ -213,4 +392,49 @@ class NotionService:
             error_detail = e.response.text if hasattr(e, 'response') else str(e)
             error_message = f"Erro ao atualizar propriedades no Notion para o lead {phone}: {error_detail}"
             logger.error(error_message)
-            print(f"[NOTION_SERVICE_ERROR] {error_message}") 
\ No newline at end of file
+            await self.invalidate(phone)
+
+    async def queue_lead_update(self, phone: str, updates: dict):
+        """
+        Enfileira uma atualização de propriedades sem esperar o Notion. Atualizações do mesmo
+        telefone feitas dentro de alguns milissegundos viram um único PATCH.
+        Use update_lead_properties quando o valor precisar ser lido logo em seguida.
+        """
+        pending = _pending_updates.setdefault(phone, {})
+        pending.update(updates)
+        if len(pending) >= _UPDATE_FLUSH_MAX_KEYS:
+            task = _flush_tasks.pop(phone, None)
+            if task:
+                task.cancel()
+            await self._flush_pending_updates(phone)
+        elif phone not in _flush_tasks:
+            _flush_tasks[phone] = asyncio.create_task(self._delayed_flush(phone))
+
+    async def _delayed_flush(self, phone: str):
+        await asyncio.sleep(_UPDATE_DEBOUNCE_SECONDS)
+        # Sai do registro antes do envio: só tarefas ainda em espera podem ser canceladas
+        _flush_tasks.pop(phone, None)
+        await self._flush_pending_updates(phone)
+
+    async def _flush_pending_updates(self, phone: str):
+        updates = _pending_updates.pop(phone, None)
+        if updates:
+            await self.update_lead_properties(phone, updates)
+
+    async def update_many(self, updates: list):
+        """
+        Atualiza vários leads de uma vez: as atualizações de um mesmo telefone são
+        combinadas em um único PATCH e os PATCHes de leads diferentes rodam em paralelo.
+        'updates' é uma lista de tuplas (telefone, dicionário de propriedades).
+        """
+        merged = {}
+        for phone, props in updates:
+            merged.setdefault(phone, {}).update(props)
+
+        results = await asyncio.gather(
+            *(self.update_lead_properties(phone, props) for phone, props in merged.items()),
+            return_exceptions=True,
+        )
+        for phone, result in zip(merged, results):
+            if isinstance(result, Exception):
+                logger.error(f"Erro ao atualizar lead {phone} no Notion em lote: {result}")
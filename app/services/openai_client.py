@@ -0,0 +1,30 @@
+import os
+from typing import Optional
+import httpx
+from openai import AsyncOpenAI
+
+# Cliente OpenAI assíncrono compartilhado pelos serviços (e pelo main.py): um único pool de
+# conexões HTTP/2 com a api.openai.com, em vez de um cliente (e um pool) por instância
+_client: Optional[AsyncOpenAI] = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(
+                http2=True,
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=25, keepalive_expiry=60),
+            ),
+        )
+    return _client
+
+
+async def close():
+    """Fecha o cliente compartilhado (chamado no shutdown da aplicação)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+    _client = None
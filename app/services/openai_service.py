@@ -1,58 +1,102 @@
+import asyncio
+import hashlib
 import logging
 import os
-from typing import Dict
-from openai import AsyncOpenAI
+import textwrap
+from typing import Dict, Optional
+import orjson
+from cachetools import TTLCache
+from app.services.openai_client import get_openai_client
 
 logger = logging.getLogger(__name__)
 
+# Single-flight dos resumos de vendas: webhooks repetidos do mesmo lead (retries da Z-API)
+# aguardam a chamada já em andamento em vez de pagar outra chamada à OpenAI
+_inflight_summaries: Dict[str, asyncio.Task] = {}
+# Resumos recém-gerados, reaproveitados por alguns segundos
+_recent_summaries: TTLCache = TTLCache(maxsize=1_000, ttl=60)
+
+# Partes fixas do prompt do resumo, montadas uma única vez. As instruções vêm antes e os
+# dados do lead no final, para o prefixo ser idêntico entre chamadas (cache de prompt da OpenAI)
+_SALES_SUMMARY_SYSTEM_MESSAGE = "Você é um gerente de vendas criando uma notificação para sua equipe no WhatsApp."
+_SALES_SUMMARY_PROMPT_PREFIX = textwrap.dedent("""\
+    Você é um gerente de vendas criando uma notificação para sua equipe no WhatsApp.
+    Crie uma frase curta, profissional e motivadora sobre um novo lead qualificado.
+    Varie o tom e a estrutura da frase a cada vez.
+
+    Exemplos de frases que você pode criar (troque os campos entre colchetes pelos dados do lead):
+    - "Atenção time: Lead quente na área! O(A) [nome], que trabalha como [profissão], quer aprender inglês por motivo de [motivo]. Isso sinaliza urgência, vamos pra cima!"
+    - "Nova oportunidade de ouro, equipe! [nome] ([profissão]) precisa de inglês para [motivo]. Parece um cliente com grande potencial de fechamento."
+    - "Alerta de lead qualificado! [nome], que atua como [profissão], está com o objetivo claro de aprender por [motivo]. É a nossa chance de mostrar nosso valor."
+
+    Agora, crie uma nova frase única e inspiradora para o lead abaixo, usando os dados fornecidos.""")
+
 class OpenAIService:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY não configurada.")
         
-        # O cliente agora é assíncrono
-        self.client = AsyncOpenAI(api_key=self.api_key)
+        # Cliente assíncrono compartilhado (um único pool de conexões com a OpenAI)
+        self.client = get_openai_client()
 
     async def generate_sales_summary(self, lead_data: Dict) -> str:
         """
         Gera um resumo curto e estratégico sobre o lead para a equipe de vendas.
+        Chamadas simultâneas ou recentes com os mesmos dados compartilham o resultado
+        (só respostas bem-sucedidas da OpenAI são reaproveitadas; o fallback não).
         """
+        # Só os campos usados no prompt entram na chave
+        key = hashlib.blake2b(
+            orjson.dumps([lead_data.get('Cliente'), lead_data.get('Profissão'), lead_data.get('Real Motivação')]),
+            digest_size=16,
+        ).hexdigest()
+        summary = _recent_summaries.get(key)
+        if summary is not None:
+            return summary
+
+        task = _inflight_summaries.get(key)
+        if task is None:
+            task = asyncio.create_task(self._generate_sales_summary(lead_data))
+            _inflight_summaries[key] = task
+            task.add_done_callback(lambda _: _inflight_summaries.pop(key, None))
+        else:
+            logger.info("Resumo de vendas já em geração para este lead; aguardando o resultado")
+        # shield: o cancelamento de um chamador não derruba a chamada compartilhada
+        summary = await asyncio.shield(task)
+        if summary is None:
+            # Mensagem de fallback em caso de erro na API da OpenAI
+            return (
+                f"Atenção time: Novo lead qualificado! {lead_data.get('Cliente', 'Um novo lead')} "
+                f"({lead_data.get('Profissão', 'não informada')}) demonstrou interesse em nossos serviços "
+                f"por motivo de {lead_data.get('Real Motivação', 'não informado')}."
+            )
+        _recent_summaries[key] = summary
+        return summary
+
+    async def _generate_sales_summary(self, lead_data: Dict) -> Optional[str]:
+        """Chama a OpenAI; retorna None se a chamada falhar."""
         lead_name = lead_data.get('Cliente', 'Um novo lead')
         profession = lead_data.get('Profissão', 'não informada')
         motivation = lead_data.get('Real Motivação', 'não informado')
 
-        prompt = f"""
-        Você é um gerente de vendas criando uma notificação para sua equipe no WhatsApp.
-        Crie uma frase curta, profissional e motivadora sobre um novo lead qualificado.
-        Varie o tom e a estrutura da frase a cada vez.
-
-        Dados do lead:
-        - Nome: {lead_name}
-        - Profissão: {profession}
-        - Motivo para aprender inglês: {motivation}
-
-        Exemplos de frases que você pode criar:
-        - "Atenção time: Lead quente na área! O(A) {lead_name}, que trabalha como {profession}, quer aprender inglês por motivo de {motivation}. Isso sinaliza urgência, vamos pra cima!"
-        - "Nova oportunidade de ouro, equipe! {lead_name} ({profession}) precisa de inglês para {motivation}. Parece um cliente com grande potencial de fechamento."
-        - "Alerta de lead qualificado! {lead_name}, que atua como {profession}, está com o objetivo claro de aprender por {motivation}. É a nossa chance de mostrar nosso valor."
-
-        Agora, crie uma nova frase única e inspiradora para este lead, usando os dados fornecidos.
-        """
+        prompt = (
+            _SALES_SUMMARY_PROMPT_PREFIX
+            + f"\n\nDados do lead:\n- Nome: {lead_name}\n- Profissão: {profession}\n- Motivo para aprender inglês: {motivation}"
+        )
         
         try:
             response = await self.client.chat.completions.create(
-                model="gpt-4",
+                model="gpt-4o-mini",
                 messages=[
-                    {"role": "system", "content": "Você é um gerente de vendas criando uma notificação para sua equipe no WhatsApp."},
+                    {"role": "system", "content": _SALES_SUMMARY_SYSTEM_MESSAGE},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.8,
-                max_tokens=150
+                max_tokens=80
             )
             
             return response.choices[0].message.content.strip()
         except Exception as e:
             logger.error(f"Erro ao gerar resumo de vendas com OpenAI: {e}")
-            # Mensagem de fallback em caso de erro na API da OpenAI
-            return f"Atenção time: Novo lead qualificado! {lead_name} ({profession}) demonstrou interesse em nossos serviços por motivo de {motivation}." 
\ No newline at end of file
+            return None
\ No newline at end of file
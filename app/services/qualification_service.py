@@ -1,9 +1,28 @@
+import asyncio
 import logging
 import os
-from openai import AsyncOpenAI
+import re
+from cachetools import TTLCache
+from app.services.cache_service import CacheService
+from app.services.openai_client import get_openai_client
 
 logger = logging.getLogger(__name__)
 
+# Respostas já obtidas por profissão normalizada ("Engenheiro " e "engenheiro" são a mesma
+# consulta). Cópia local na frente do cache no Redis, compartilhado entre os workers.
+_profession_cache: TTLCache = TTLCache(maxsize=5_000, ttl=24 * 3600)
+
+
+# Palavras-chave do motivo, compiladas uma única vez em uma regex por categoria
+_HIGH_PRIO_KEYWORDS = ["viagem", "trabalho", "mudar de país", "oportunidade"]
+_LOW_PRIO_KEYWORDS = ["aprimorar", "melhorar", "hobby"]
+_HIGH_PRIO_RE = re.compile("|".join(map(re.escape, _HIGH_PRIO_KEYWORDS)))
+_LOW_PRIO_RE = re.compile("|".join(map(re.escape, _LOW_PRIO_KEYWORDS)))
+
+
+def _normalize_profession(profession: str) -> str:
+    return " ".join(profession.lower().split())
+
 class QualificationService:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
@@ -11,16 +30,28 @@ class QualificationService:
             logger.warning("OPENAI_API_KEY não configurada. A qualificação de profissão será desativada.")
             self.client = None
         else:
-            self.client = AsyncOpenAI(api_key=self.api_key)
+            self.client = get_openai_client()
 
-        self.high_prio_keywords = ["viagem", "trabalho", "mudar de país", "oportunidade"]
-        self.low_prio_keywords = ["aprimorar", "melhorar", "hobby"]
+        self.high_prio_keywords = _HIGH_PRIO_KEYWORDS
+        self.low_prio_keywords = _LOW_PRIO_KEYWORDS
 
     async def _is_high_income_profession(self, profession: str) -> bool:
         """Usa o GPT para determinar se uma profissão é provavelmente de alta renda."""
         if not self.client or not profession:
             return False
 
+        key = _normalize_profession(profession)
+        if not key:
+            return False
+        cached = _profession_cache.get(key)
+        if cached is None:
+            cached = await CacheService.get_profession_high_income(key)
+            if cached is not None:
+                _profession_cache[key] = cached
+        if cached is not None:
+            logger.info(f"Análise da profissão '{profession}' reaproveitada do cache: {'sim' if cached else 'não'}")
+            return cached
+
         try:
             prompt = f"A profissão '{profession}' é geralmente considerada de alta renda no Brasil? Responda apenas 'Sim' ou 'Não'."
             response = await self.client.chat.completions.create(
@@ -31,7 +62,11 @@ class QualificationService:
             )
             answer = response.choices[0].message.content.strip().lower()
             logger.info(f"Análise da profissão '{profession}' para qualificação: {answer}")
-            return "sim" in answer
+            high_income = "sim" in answer
+            # Só respostas válidas entram no cache; erros da OpenAI voltam a consultar na próxima vez
+            _profession_cache[key] = high_income
+            await CacheService.set_profession_high_income(key, high_income)
+            return high_income
         except Exception as e:
             logger.error(f"Erro ao analisar profissão com OpenAI: {e}")
             return False
@@ -41,7 +76,7 @@ class QualificationService:
         motivo_lower = motivo.lower()
 
         # Regra 1: Palavras-chave de alta prioridade no motivo
-        if any(keyword in motivo_lower for keyword in self.high_prio_keywords):
+        if _HIGH_PRIO_RE.search(motivo_lower):
             logger.info(f"Lead classificado como 'Alto' por palavra-chave no motivo: '{motivo}'")
             return "Alto"
 
@@ -50,16 +85,22 @@ class QualificationService:
             logger.info(f"Lead classificado como 'Alto' por profissão: '{profissao}'")
             return "Alto"
         
-        # Regra 3: Motivo vago de baixa prioridade
-        if any(keyword in motivo_lower for keyword in self.low_prio_keywords):
-            if not any(hp_keyword in motivo_lower for hp_keyword in self.high_prio_keywords):
-                logger.info(f"Lead classificado como 'Baixo' por motivo vago: '{motivo}'")
-                return "Baixo"
+        # Regra 3: Motivo vago de baixa prioridade (palavras de alta prioridade já retornaram na regra 1)
+        if _LOW_PRIO_RE.search(motivo_lower):
+            logger.info(f"Lead classificado como 'Baixo' por motivo vago: '{motivo}'")
+            return "Baixo"
 
         # Classificação padrão
         logger.info("Nenhuma regra específica aplicada. Classificando como 'Baixo' por padrão.")
         return "Baixo"
 
+    async def classify_leads(self, leads: list) -> list:
+        """
+        Classifica vários leads em paralelo (ex.: reclassificação em massa).
+        'leads' é uma lista de tuplas (motivo, profissão); o resultado segue a mesma ordem.
+        """
+        return await asyncio.gather(*(self.classify_lead(motivo, profissao) for motivo, profissao in leads))
+
     async def analyze_name_with_ai(self, name: str) -> dict:
         """
         Usa um modelo de IA para analisar um nome e determinar se é de pessoa, empresa,
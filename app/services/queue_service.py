@@ -61,12 +61,13 @@ class QueueService:
             
             elevenlabs_service = ElevenLabsService()
             # 3. Geração do áudio de resposta
-            audio_response = elevenlabs_service.generate_audio(zaia_response['message'])
+            audio_response = await elevenlabs_service.generate_audio(zaia_response['message'])
             
             # 4. Envio da resposta com simulação de gravação
             await ZAPIService.send_audio_with_typing(
                 phone=task_data['phone'],
-                audio_bytes=audio_response
+                audio_bytes=audio_response,
+                original_text=zaia_response['message']
             )
             
             logger.info(f"Tarefa processada com sucesso para {task_data['phone']}")
@@ -1,70 +1,106 @@
+import io
 import os
+import hashlib
 import logging
-import tempfile
-import requests
-from openai import OpenAI
-import httpx
+from typing import Optional
+import aiohttp
+from app.services.cache_service import CacheService
+from app.services.openai_client import get_openai_client
 
 logger = logging.getLogger(__name__)
 
+# Sessão HTTP compartilhada para baixar os áudios (keep-alive com o storage da Z-API)
+_session: Optional[aiohttp.ClientSession] = None
+
+# Tamanho dos blocos lidos da resposta durante o download
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=50, keepalive_timeout=60)
+        )
+    return _session
+
+# Upload + transcrição demoram mais que as demais chamadas à OpenAI
+_TRANSCRIPTION_TIMEOUT = 60.0
+
 class WhisperService:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
-        # Inicializa o cliente OpenAI com configuração explícita de httpx
-        http_client = httpx.Client(
-            timeout=60.0,
-            follow_redirects=True
-        )
-        self.client = OpenAI(
-            api_key=self.api_key,
-            http_client=http_client
-        )
+        # Cliente assíncrono compartilhado (um único pool de conexões com a OpenAI)
+        self.client = get_openai_client()
+
+    @staticmethod
+    async def close():
+        """Fecha a sessão HTTP compartilhada (chamado no shutdown da aplicação)."""
+        global _session
+        if _session is not None and not _session.closed:
+            await _session.close()
+        _session = None
 
     async def transcribe_audio(self, audio_url: str) -> str:
         """
         Processa mensagem de áudio: baixa, transcreve usando OpenAI Whisper API e retorna o texto
         """
+        # Webhooks duplicados trazem a mesma URL: a transcrição sai do cache sem baixar o áudio
+        url_key = "url:" + hashlib.blake2b(audio_url.encode(), digest_size=16).hexdigest()
+        cached_text = await CacheService.get_transcript(url_key)
+        if cached_text is not None:
+            logger.info("Transcrição reaproveitada do cache (mesma URL)")
+            return cached_text
+
         try:
             logger.info(f"Baixando áudio de {audio_url}")
-            # Download do arquivo de áudio
-            audio_response = requests.get(audio_url)
-            audio_response.raise_for_status()  # Verifica se o download foi bem-sucedido
+            # Download do arquivo de áudio, acumulado em memória (sem arquivo temporário)
+            async with _get_session().get(audio_url) as audio_response:
+                audio_response.raise_for_status()  # Verifica se o download foi bem-sucedido
+                
+                # Determina a extensão do arquivo baseado no Content-Type ou URL
+                content_type = audio_response.headers.get('content-type', '')
+                if 'ogg' in content_type or audio_url.endswith('.ogg'):
+                    suffix = ".ogg"
+                elif 'mp3' in content_type or audio_url.endswith('.mp3'):
+                    suffix = ".mp3"
+                elif 'wav' in content_type or audio_url.endswith('.wav'):
+                    suffix = ".wav"
+                else:
+                    suffix = ".ogg"  # Padrão para Z-API
+                
+                audio_file = io.BytesIO()
+                audio_hash = hashlib.blake2b(digest_size=16)
+                async for chunk in audio_response.content.iter_chunked(_DOWNLOAD_CHUNK_SIZE):
+                    audio_file.write(chunk)
+                    audio_hash.update(chunk)
             
-            # Determina a extensão do arquivo baseado no Content-Type ou URL
-            content_type = audio_response.headers.get('content-type', '')
-            if 'ogg' in content_type or audio_url.endswith('.ogg'):
-                suffix = ".ogg"
-            elif 'mp3' in content_type or audio_url.endswith('.mp3'):
-                suffix = ".mp3"
-            elif 'wav' in content_type or audio_url.endswith('.wav'):
-                suffix = ".wav"
-            else:
-                suffix = ".ogg"  # Padrão para Z-API
+            # Áudios encaminhados chegam com outra URL mas o mesmo conteúdo
+            content_key = "b2:" + audio_hash.hexdigest()
+            cached_text = await CacheService.get_transcript(content_key)
+            if cached_text is not None:
+                logger.info("Transcrição reaproveitada do cache (mesmo conteúdo)")
+                await CacheService.set_transcript([url_key], cached_text)
+                return cached_text
             
-            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_audio:
-                temp_audio.write(audio_response.content)
-                temp_audio_path = temp_audio.name
+            # O SDK da OpenAI usa o atributo name para inferir o formato do arquivo
+            audio_file.seek(0)
+            audio_file.name = f"audio{suffix}"
             
             logger.info(f"Transcrevendo áudio com OpenAI Whisper API (arquivo: {suffix})")
-            with open(temp_audio_path, "rb") as audio_file:
-                transcript = self.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="pt"  # Especifica português para melhor precisão
-                )
-            
-            # Remove o arquivo temporário
-            os.unlink(temp_audio_path)
+            # response_format="text": a API devolve só o texto (corpo menor, sem JSON para decodificar)
+            transcript = (await self.client.with_options(timeout=_TRANSCRIPTION_TIMEOUT).audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                language="pt",  # Especifica português para melhor precisão
+                response_format="text",
+                temperature=0,
+            )).strip()
             
-            logger.info(f"Transcrição concluída: {transcript.text}")
-            return transcript.text
+            logger.info(f"Transcrição concluída: {transcript}")
+            await CacheService.set_transcript([url_key, content_key], transcript)
+            return transcript
             
         except Exception as e:
             logger.error(f"Erro ao transcrever áudio: {str(e)}")
-            # Limpa arquivo temporário em caso de erro
-            try:
-                if 'temp_audio_path' in locals():
-                    os.unlink(temp_audio_path)
-            except:
-                pass
-            raise 
\ No newline at end of file
+            raise 
@@ -1,26 +1,94 @@
+import gzip
 import logging
-import base64
-import aiohttp
+import math
+import httpx
+import orjson
+import pybase64
 import asyncio
-from app.config.settings import Settings
+from types import MappingProxyType
+from typing import Optional
+from app.config.settings import settings
 from app.services.cache_service import CacheService
 
+# Logs de informação usam formatação preguiçosa (%s): payloads e respostas só viram texto
+# se o nível INFO estiver habilitado
 logger = logging.getLogger(__name__)
 
+# URLs e cabeçalhos montados uma única vez no import: as configurações não mudam durante o processo
+_SEND_TEXT_URL = f"{settings.Z_API_BASE_URL}/send-text"
+_SEND_AUDIO_URL = f"{settings.Z_API_BASE_URL}/send-audio"
+_AUTH_HEADERS = {"Client-Token": settings.Z_API_SECURITY_TOKEN}
+_JSON_HEADERS = {**_AUTH_HEADERS, "Content-Type": "application/json"}
+_GZIP_JSON_HEADERS = {**_JSON_HEADERS, "Content-Encoding": "gzip"}
+# Início do campo "audio" (data URL em base64) no corpo JSON de /send-audio
+_AUDIO_DATA_URL_FIELD = b',"audio":"data:audio/ogg;base64,'
+# Acima deste tamanho (bytes) o base64 do áudio é calculado fora do event loop
+_THREAD_ENCODE_THRESHOLD = 128 * 1024
+# Abaixo deste tamanho (bytes) o corpo não é comprimido: o overhead do HTTP domina
+_GZIP_MIN_SIZE = 16 * 1024
+# Retornos fixos dos envios, compartilhados (somente leitura) em vez de um dict novo por chamada
+_SUCCESS = MappingProxyType({"success": True})
+_SKIPPED_HUMAN_OVERRIDE = MappingProxyType({"skipped": "human_override_active"})
+
+
+def _duration_table(chars_per_second: float, min_duration: float, max_duration: float) -> tuple:
+    """
+    Durações pré-calculadas por tamanho de mensagem (len / velocidade, limitado a [mín, máx]).
+    A partir do último índice a duração fica sempre no máximo.
+    """
+    saturation = math.ceil(max_duration * chars_per_second)
+    return tuple(max(min_duration, min(n / chars_per_second, max_duration)) for n in range(saturation + 1))
+
+# Digitação: ~40 palavras por minuto = ~200 caracteres por minuto (3.3/s); mínimo de 2s
+# para ser perceptível, máximo de 8s
+_TYPING_DURATIONS = _duration_table(chars_per_second=3.3, min_duration=2.0, max_duration=8.0)
+# Fala: ~150 palavras por minuto, ~5 caracteres por palavra = ~12.5 caracteres por segundo;
+# mínimo de 1.5s para parecer que gravou algo, máximo de 10s para não deixar o usuário esperando
+_AUDIO_DURATIONS = _duration_table(chars_per_second=12.5, min_duration=1.5, max_duration=10.0)
+
+# Cliente HTTP compartilhado, criado sob demanda: com HTTP/2 os envios simultâneos
+# (rajadas de textos e áudios) são multiplexados na mesma conexão com a Z-API
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=50, keepalive_expiry=75),
+        )
+    return _client
+
 class ZAPIService:
+    @staticmethod
+    async def close():
+        """Fecha o cliente HTTP compartilhado (chamado no shutdown da aplicação)."""
+        global _client
+        if _client is not None and not _client.is_closed:
+            await _client.aclose()
+        _client = None
+
+    @staticmethod
+    async def warmup():
+        """
+        Abre a conexão com a Z-API no startup (TCP + TLS), para a primeira mensagem real
+        já encontrar a conexão pronta no pool (com HTTP/2, uma conexão atende os envios simultâneos).
+        """
+        try:
+            await _get_client().head(settings.Z_API_BASE_URL)
+            logger.info("🔥 Conexão com a Z-API pré-aquecida")
+        except Exception as e:
+            logger.warning(f"Não foi possível pré-aquecer a conexão com a Z-API: {e}")
+
     @staticmethod
     def calculate_typing_duration(message: str) -> float:
         """
         Calcula o tempo de digitação baseado no tamanho da mensagem
         Simula uma velocidade de digitação humana realista, com máximo de 8 segundos.
         """
-        # Velocidade média: ~40 palavras por minuto = ~200 caracteres por minuto
-        chars_per_second = 3.3
-        min_duration = 2.0  # Aumentado para ser mais perceptível
-        max_duration = 8.0
-        
-        calculated_duration = len(message) / chars_per_second
-        return max(min_duration, min(calculated_duration, max_duration))
+        return _TYPING_DURATIONS[min(len(message), len(_TYPING_DURATIONS) - 1)]
 
     @staticmethod
     def calculate_audio_duration(message: str) -> float:
@@ -28,14 +96,61 @@ class ZAPIService:
         Calcula a duração da fala para uma mensagem de áudio.
         Assume uma velocidade média de fala.
         """
-        # Velocidade média de fala: ~150 palavras por minuto. Uma palavra tem ~5 caracteres.
-        # 150 * 5 = 750 caracteres por minuto / 60s = ~12.5 caracteres por segundo.
-        chars_per_second = 12.5
-        min_duration = 1.5  # Mínimo para parecer que gravou algo
-        max_duration = 10.0 # Máximo para não deixar o usuário esperando muito
-        
-        calculated_duration = len(message) / chars_per_second
-        return max(min_duration, min(calculated_duration, max_duration))
+        return _AUDIO_DURATIONS[min(len(message), len(_AUDIO_DURATIONS) - 1)]
+
+    @staticmethod
+    async def _start_override_check(phone: str) -> asyncio.Task:
+        """
+        Dispara a consulta do override humano em segundo plano. O sleep(0) cede a vez uma
+        vez para o comando já ser enviado ao Redis antes do trabalho de CPU do chamador.
+        """
+        task = asyncio.create_task(CacheService.is_human_override_active(phone))
+        await asyncio.sleep(0)
+        return task
+
+    @staticmethod
+    def _log_success(response: httpx.Response):
+        """O corpo de uma resposta 200 só é decodificado (response.text) com o log em DEBUG."""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Resposta do Z-API: Status=%s, Body=%s", response.status_code, response.text)
+
+    @staticmethod
+    async def _build_audio_request(phone: str, audio_bytes: bytes, fields: dict) -> dict:
+        """
+        Monta os argumentos do POST em /send-audio. Com Z_API_AUDIO_MULTIPART, o áudio vai
+        como arquivo binário em multipart/form-data (sem base64: corpo ~25% menor e sem
+        codificação); caso contrário, como data URL em base64 no JSON (formato documentado),
+        comprimido com gzip quando Z_API_AUDIO_GZIP está ativo e o corpo é grande.
+        """
+        if settings.Z_API_AUDIO_MULTIPART:
+            # Sem Content-Type explícito: o httpx define o boundary do multipart
+            form = {"phone": phone}
+            for name, value in fields.items():
+                form[name] = str(value).lower() if isinstance(value, bool) else str(value)
+            return {
+                "headers": _AUTH_HEADERS,
+                "data": form,
+                "files": {"audio": ("audio.ogg", audio_bytes, "audio/ogg")},
+            }
+
+        # Áudios grandes são codificados em uma thread para não travar o event loop
+        if len(audio_bytes) > _THREAD_ENCODE_THRESHOLD:
+            audio_base64 = await asyncio.to_thread(pybase64.b64encode, audio_bytes)
+        else:
+            audio_base64 = pybase64.b64encode(audio_bytes)
+        # O JSON é montado direto em bytes: o base64 (centenas de KB) não é decodificado para
+        # str nem reprocessado pelo serializador, já que o alfabeto base64 não precisa de escape
+        body = (
+            orjson.dumps({"phone": phone, **fields})[:-1]
+            + _AUDIO_DATA_URL_FIELD
+            + audio_base64
+            + b'"}'
+        )
+        if settings.Z_API_AUDIO_GZIP and len(body) >= _GZIP_MIN_SIZE:
+            # Nível 1: em texto base64 comprime quase tanto quanto o padrão (6) e é bem mais rápido
+            body = await asyncio.to_thread(gzip.compress, body, compresslevel=1)
+            return {"headers": _GZIP_JSON_HEADERS, "content": body}
+        return {"headers": _JSON_HEADERS, "content": body}
 
     @staticmethod
     async def send_text_with_context_delay(phone: str, message: str, context_delay: int = 30):
@@ -57,7 +172,7 @@ class ZAPIService:
             message: Mensagem a ser enviada
             context_delay: Delay em segundos antes de enviar (padrão: 30s)
         """
-        logger.info(f"Enviando mensagem com delay de contexto de {context_delay}s para {phone}")
+        logger.info("Enviando mensagem com delay de contexto de %ss para %s", context_delay, phone)
         
         # Aguarda o delay de contexto
         await asyncio.sleep(context_delay)
@@ -68,12 +183,9 @@ class ZAPIService:
     @staticmethod
     async def send_text_with_typing(phone: str, message: str):
         """
-        Envia mensagem de texto com simulação de digitação usando o delayTyping da Z-API.
+        Envia mensagem de texto com simulação de digitação usando o delayTyping da Z-API
+        (uma única requisição; o override humano é verificado em send_text).
         """
-        # Respeitar override humano: não enviar mensagens automáticas
-        if await CacheService.is_human_override_active(phone):
-            logger.info(f"🛑 Override humano ativo para {phone}. Pulando envio de texto.")
-            return {"skipped": "human_override_active"}
         typing_duration = ZAPIService.calculate_typing_duration(message)
         return await ZAPIService.send_text(phone, message, delay_typing=int(typing_duration))
 
@@ -84,15 +196,8 @@ class ZAPIService:
         """
         # Respeitar override humano: não enviar mensagens automáticas
         if await CacheService.is_human_override_active(phone):
-            logger.info(f"🛑 Override humano ativo para {phone}. Pulando envio de texto.")
-            return {"skipped": "human_override_active"}
-        settings = Settings()
-        url = f"{settings.Z_API_BASE_URL}/send-text"
-        headers = {
-            "Content-Type": "application/json",
-            "Client-Token": settings.Z_API_SECURITY_TOKEN
-        }
-        
+            logger.info("🛑 Override humano ativo para %s. Pulando envio de texto.", phone)
+            return _SKIPPED_HUMAN_OVERRIDE
         payload = {
             "phone": phone,
             "message": message
@@ -102,22 +207,20 @@ class ZAPIService:
         if delay_typing and delay_typing > 0:
             payload["delayTyping"] = delay_typing
         
-        async with aiohttp.ClientSession() as session:
-            try:
-                logger.info(f"Enviando mensagem para {phone}. Payload: {payload}")
-                async with session.post(url, headers=headers, json=payload) as response:
-                    response_text = await response.text()
-                    logger.info(f"Resposta do Z-API: Status={response.status}, Body={response_text}")
-                    if response.status == 200:
-                        logger.info(f"Mensagem enviada para {phone}")
-                        return {"success": True}
-                    else:
-                        error_text = f"Status: {response.status}, Response: {response_text}"
-                        logger.error(f"Erro ao enviar mensagem: {error_text}")
-                        return {"error": error_text}
-            except Exception as e:
-                logger.error(f"Exceção ao enviar mensagem: {str(e)}")
-                return {"error": str(e)}
+        try:
+            logger.info("Enviando mensagem para %s. Payload: %s", phone, payload)
+            response = await _get_client().post(_SEND_TEXT_URL, headers=_JSON_HEADERS, content=orjson.dumps(payload))
+            if response.status_code == 200:
+                ZAPIService._log_success(response)
+                logger.info("Mensagem enviada para %s", phone)
+                return _SUCCESS
+            else:
+                error_text = f"Status: {response.status_code}, Response: {response.text}"
+                logger.error(f"Erro ao enviar mensagem: {error_text}")
+                return {"error": error_text}
+        except Exception as e:
+            logger.error(f"Exceção ao enviar mensagem: {str(e)}")
+            return {"error": str(e)}
 
     @staticmethod
     async def send_audio_with_typing(phone: str, audio_bytes: bytes, original_text: str):
@@ -125,40 +228,41 @@ class ZAPIService:
         Envia áudio, usando um delayMessage variável baseado no texto original
         para simular o tempo de gravação.
         """
-        # Respeitar override humano: não enviar mensagens automáticas
-        if await CacheService.is_human_override_active(phone):
-            logger.info(f"🛑 Override humano ativo para {phone}. Pulando envio de áudio.")
-            return {"skipped": "human_override_active"}
-        settings = Settings()
-        url = f"{settings.Z_API_BASE_URL}/send-audio"
-        headers = {
-            "Content-Type": "application/json",
-            "Client-Token": settings.Z_API_SECURITY_TOKEN
-        }
-        
-        audio_data_url = f"data:audio/ogg;base64,{base64.b64encode(audio_bytes).decode('utf-8')}"
-        
+        # Respeitar override humano: não enviar mensagens automáticas. A consulta ao Redis
+        # roda enquanto o corpo (base64) é montado
+        override_check = await ZAPIService._start_override_check(phone)
+
         # Calcula a duração da gravação com base no texto
         recording_duration = ZAPIService.calculate_audio_duration(original_text)
 
-        payload = {
-            "phone": phone,
-            "audio": audio_data_url,
+        fields = {
             "delayMessage": int(recording_duration),
             "waveform": True
         }
+        try:
+            request_kwargs = await ZAPIService._build_audio_request(phone, audio_bytes, fields)
+        except Exception as e:
+            # A consulta do override é descartada e aguardada (sem exceção "never retrieved")
+            override_check.cancel()
+            await asyncio.gather(override_check, return_exceptions=True)
+            logger.error(f"Exceção ao montar o envio de áudio: {str(e)}")
+            return {"error": str(e)}
+
+        if await override_check:
+            logger.info("🛑 Override humano ativo para %s. Pulando envio de áudio.", phone)
+            return _SKIPPED_HUMAN_OVERRIDE
         
         try:
-            logger.info(f"Enviando áudio para {phone}. Payload: {payload}")
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        logger.info(f"Áudio enviado para {phone}")
-                        return {"success": True}
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Erro ao enviar áudio: {response.status} - {error_text}")
-                        return {"error": error_text}
+            logger.info("Enviando áudio para %s (%d bytes). Campos: %s", phone, len(audio_bytes), fields)
+            response = await _get_client().post(_SEND_AUDIO_URL, **request_kwargs)
+            if response.status_code == 200:
+                ZAPIService._log_success(response)
+                logger.info("Áudio enviado para %s", phone)
+                return _SUCCESS
+            else:
+                error_text = response.text
+                logger.error(f"Erro ao enviar áudio: {response.status_code} - {error_text}")
+                return {"error": error_text}
         except Exception as e:
             logger.error(f"Exceção ao enviar áudio: {str(e)}")
             return {"error": str(e)}
@@ -168,41 +272,37 @@ class ZAPIService:
         """
         Envia áudio via Z-API sem delay (mantido para compatibilidade, se necessário).
         """
-        # Respeitar override humano: não enviar mensagens automáticas
-        if await CacheService.is_human_override_active(phone):
-            logger.info(f"🛑 Override humano ativo para {phone}. Pulando envio de áudio.")
-            return {"skipped": "human_override_active"}
-        settings = Settings()
-        url = f"{settings.Z_API_BASE_URL}/send-audio"
-        try:
-            # Codificar o áudio em base64 e adicionar o prefixo
-            audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-            audio_data_url = f"data:audio/ogg;base64,{audio_base64}"
-
-            payload = {
-                "phone": phone,
-                "audio": audio_data_url,
-                "viewOnce": False,
-                "waveform": True
-            }
+        # Respeitar override humano: não enviar mensagens automáticas. A consulta ao Redis
+        # roda enquanto o corpo (base64) é montado
+        override_check = await ZAPIService._start_override_check(phone)
 
-            headers = {
-                "Content-Type": "application/json",
-                "Client-Token": settings.Z_API_SECURITY_TOKEN
-            }
+        fields = {
+            "viewOnce": False,
+            "waveform": True
+        }
+        try:
+            request_kwargs = await ZAPIService._build_audio_request(phone, audio_bytes, fields)
+        except Exception as e:
+            # A consulta do override é descartada e aguardada (sem exceção "never retrieved")
+            override_check.cancel()
+            await asyncio.gather(override_check, return_exceptions=True)
+            logger.error(f"Exceção ao montar o envio de áudio: {str(e)}")
+            return {"error": str(e)}
 
-            async with aiohttp.ClientSession() as session:
-                logger.info(f"Enviando áudio para {phone}. URL: {url}")
-                async with session.post(url, headers=headers, json=payload) as response:
-                    response_text = await response.text()
-                    logger.info(f"Resposta do Z-API (áudio): Status={response.status}, Body={response_text}")
-                    if response.status == 200:
-                        logger.info(f"Áudio enviado para {phone}")
-                        return {"success": True}
-                    else:
-                        error_text = f"Status: {response.status}, Response: {response_text}"
-                        logger.error(f"Erro ao enviar áudio: {error_text}")
-                        return {"error": error_text}
+        if await override_check:
+            logger.info("🛑 Override humano ativo para %s. Pulando envio de áudio.", phone)
+            return _SKIPPED_HUMAN_OVERRIDE
+        try:
+            logger.info("Enviando áudio para %s (%d bytes)", phone, len(audio_bytes))
+            response = await _get_client().post(_SEND_AUDIO_URL, **request_kwargs)
+            if response.status_code == 200:
+                ZAPIService._log_success(response)
+                logger.info("Áudio enviado para %s", phone)
+                return _SUCCESS
+            else:
+                error_text = f"Status: {response.status_code}, Response: {response.text}"
+                logger.error(f"Erro ao enviar áudio: {error_text}")
+                return {"error": error_text}
         except Exception as e:
             logger.error(f"Exceção ao enviar áudio: {str(e)}")
             return {"error": str(e)} 
\ No newline at end of file
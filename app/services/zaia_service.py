@@ -1,20 +1,86 @@
+import asyncio
 import logging
+from typing import Dict, Optional
 import aiohttp
-from app.config.settings import Settings
+import orjson
+from cachetools import TTLCache
+from yarl import URL
+from app.config.settings import settings
 from app.services.cache_service import CacheService
+from app.services.circuit_breaker import CircuitBreaker
 import requests
 import time
 
 logger = logging.getLogger(__name__)
 
+# Após falhas seguidas da Zaia, o envio de mensagens desiste na hora por alguns segundos
+_breaker = CircuitBreaker(threshold=5, reset_timeout=30.0)
+
+# Configurações, URLs e cabeçalhos montados uma única vez no import: não mudam durante o processo.
+# A falta de configuração só é acusada no uso, para o restante da aplicação subir normalmente.
+# As URLs são yarl.URL: a query string é montada com with_query (valores codificados) e o
+# aiohttp usa o objeto direto, sem analisar a string de novo
+_BASE_URL = settings.ZAIA_BASE_URL.rstrip("/")
+_AGENT_ID = int(settings.ZAIA_AGENT_ID) if settings.ZAIA_AGENT_ID else None
+_HEADERS = {
+    "Authorization": f"Bearer {settings.ZAIA_API_KEY}",
+    "Content-Type": "application/json",
+    "Accept": "application/json"
+}
+_RETRIEVE_CHAT_URL = URL(f"{_BASE_URL}/v1.1/api/external-generative-chat/retrieve")
+_RETRIEVE_CHATS_URL = URL(f"{_BASE_URL}/v1.1/api/external-generative-chat/retrieve-multiple")
+_CREATE_CHAT_URL = URL(f"{_BASE_URL}/v1.1/api/external-generative-chat/create")
+_CREATE_MESSAGE_URL = URL(f"{_BASE_URL}/v1.1/api/external-generative-message/create")
+_RETRIEVE_MESSAGES_URL = URL(f"{_BASE_URL}/v1.1/api/external-generative-message/retrieve-multiple")
+
+# Timeouts explícitos (o padrão do aiohttp é de 5 minutos): consultas devem responder rápido;
+# a criação de chat é ainda mais curta; o envio de mensagem aguarda a geração da resposta
+_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5, sock_read=15)
+_CREATE_CHAT_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=5)
+_MESSAGE_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=5)
+
+# Sessão HTTP compartilhada (keep-alive com a Zaia), criada sob demanda. Os cabeçalhos de
+# autenticação ficam na sessão, então as requisições não montam mais um dict a cada chamada
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100, limit_per_host=32, keepalive_timeout=75, ttl_dns_cache=300
+            ),
+            timeout=_TIMEOUT,
+            headers=_HEADERS,
+        )
+    return _session
+
+# Valores que identificam o chat em uso de um telefone nas listagens da Zaia
+_WHATSAPP = "whatsapp"
+_ACTIVE = "active"
+
+# Single-flight da busca/criação de chat: webhooks simultâneos do mesmo telefone aguardam a
+# busca já em andamento em vez de repetir as consultas (e criar chats duplicados)
+_inflight_chats: Dict[str, asyncio.Task] = {}
+
 class ZaiaService:
-    # Cache para armazenar o último chat ID válido por telefone
-    _chat_cache = {}
+    # Último chat ID já verificado por telefone: enquanto válido, get_or_create_chat não
+    # consulta o Redis nem refaz a verificação do chat na Zaia
+    _chat_cache: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
     # Cache de backup para persistir entre instâncias
     _persistent_cache = {}
     
     def __init__(self):
         pass  # Removido IntentService - Zaia detecta intenções automaticamente
+
+    @staticmethod
+    async def close():
+        """Fecha a sessão HTTP compartilhada (chamado no shutdown da aplicação)."""
+        global _session
+        if _session is not None and not _session.closed:
+            await _session.close()
+        _session = None
     
     @staticmethod
     async def clear_chat_cache(phone: str = None):
@@ -25,12 +91,12 @@ class ZaiaService:
             await CacheService.clear_chat_id(phone)
             ZaiaService._chat_cache.pop(phone, None)
             ZaiaService._persistent_cache.pop(phone, None)
-            logger.info(f"🗑️ Cache limpo para {phone}")
+            logger.info("🗑️ Cache limpo para %s", phone)
         else:
             await CacheService.clear_all_chats()
             ZaiaService._chat_cache.clear()
             ZaiaService._persistent_cache.clear()
-            logger.info(f"🗑️ Cache completo limpo")
+            logger.info("🗑️ Cache completo limpo")
 
     @staticmethod
     async def get_or_create_chat(phone: str):
@@ -40,59 +106,69 @@ class ZaiaService:
         2. Se encontrar, usa o mais recente
         3. Se não encontrar, cria um novo
         4. Mantém cache apenas para performance
+        Chamadas simultâneas para o mesmo telefone compartilham o resultado.
         """
-        logger.info(f"=== BUSCANDO/CRIANDO CHAT ÚNICO para telefone: {phone} ===")
+        task = _inflight_chats.get(phone)
+        if task is None:
+            task = asyncio.create_task(ZaiaService._get_or_create_chat(phone))
+            _inflight_chats[phone] = task
+            task.add_done_callback(lambda _: _inflight_chats.pop(phone, None))
+        else:
+            logger.info("⏳ Busca de chat já em andamento para %s; aguardando o resultado", phone)
+        # shield: o cancelamento de um chamador não derruba a busca compartilhada
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _get_or_create_chat(phone: str):
+        logger.info("=== BUSCANDO/CRIANDO CHAT ÚNICO para telefone: %s ===", phone)
         
-        settings = Settings()
-        base_url = settings.ZAIA_BASE_URL.rstrip("/")
-        agent_id = settings.ZAIA_AGENT_ID
-        api_key = settings.ZAIA_API_KEY
+        verified_chat_id = ZaiaService._chat_cache.get(phone)
+        if verified_chat_id is not None:
+            logger.info("💾 Chat já verificado em memória para %s: %s", phone, verified_chat_id)
+            return verified_chat_id
         
         # Verificar configurações
-        if not all([api_key, agent_id, base_url]):
+        if not all([settings.ZAIA_API_KEY, _AGENT_ID, _BASE_URL]):
             raise Exception("Configurações da Zaia incompletas")
-            
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
         
         # PASSO 1: Verificar cache rápido (só para performance)
         cached_chat_id = await CacheService.get_chat_id(phone)
         if cached_chat_id:
-            logger.info(f"💾 Chat em cache para {phone}: {cached_chat_id}")
+            logger.info("💾 Chat em cache para %s: %s", phone, cached_chat_id)
             # Verificar se ainda é válido
-            if await ZaiaService._verify_chat_functional(base_url, headers, cached_chat_id):
-                logger.info(f"✅ Chat do cache é válido: {cached_chat_id}")
+            if await ZaiaService._verify_chat_functional(cached_chat_id):
+                logger.info("✅ Chat do cache é válido: %s", cached_chat_id)
+                ZaiaService._chat_cache[phone] = cached_chat_id
                 return cached_chat_id
             else:
-                logger.warning(f"⚠️ Chat do cache inválido, removendo: {cached_chat_id}")
+                logger.warning("⚠️ Chat do cache inválido, removendo: %s", cached_chat_id)
                 await CacheService.clear_chat_id(phone)
         
         # PASSO 2: Buscar na API da Zaia o chat ativo deste telefone
-        logger.info(f"🔍 Buscando chat ativo na API da Zaia para {phone}")
-        active_chat_id = await ZaiaService._find_active_chat_by_phone(phone)
+        logger.info("🔍 Buscando chat ativo na API da Zaia para %s", phone)
+        try:
+            active_chat_id = await ZaiaService._find_active_chat_by_phone(phone)
+        except asyncio.TimeoutError:
+            logger.error(f"❌ Zaia não respondeu a tempo na busca de chat para {phone}")
+            raise Exception("Zaia não respondeu a tempo na busca de chat")
         
         if active_chat_id:
-            logger.info(f"✅ CHAT ATIVO ENCONTRADO para {phone}: {active_chat_id}")
-            # Verificar se este chat ainda é funcional antes de usar
-            if await ZaiaService._verify_chat_functional(base_url, headers, active_chat_id):
-                logger.info(f"✅ Chat encontrado é funcional: {active_chat_id}")
-                # Salvar no cache para próximas consultas
-                await CacheService.set_chat_id(phone, active_chat_id)
-                return active_chat_id
-            else:
-                logger.warning(f"⚠️ Chat encontrado não é funcional: {active_chat_id}")
-                # Continuar para criar novo chat
+            # A busca múltipla já filtra por status "active": não é preciso consultar o chat
+            # de novo no endpoint individual
+            logger.info("✅ CHAT ATIVO ENCONTRADO para %s: %s", phone, active_chat_id)
+            # Salvar no cache para próximas consultas
+            await CacheService.set_chat_id(phone, active_chat_id)
+            ZaiaService._chat_cache[phone] = active_chat_id
+            return active_chat_id
         
         # PASSO 3: Criar novo chat se não existe nenhum ativo
-        logger.info(f"🆕 Nenhum chat ativo encontrado, criando novo para {phone}")
-        new_chat_id = await ZaiaService._create_new_chat(base_url, headers, agent_id, phone)
+        logger.info("🆕 Nenhum chat ativo encontrado, criando novo para %s", phone)
+        new_chat_id = await ZaiaService._create_new_chat(phone)
         
         # Salvar no cache
         await CacheService.set_chat_id(phone, new_chat_id)
-        logger.info(f"✅ NOVO CHAT CRIADO para {phone}: {new_chat_id}")
+        ZaiaService._chat_cache[phone] = new_chat_id
+        logger.info("✅ NOVO CHAT CRIADO para %s: %s", phone, new_chat_id)
         return new_chat_id
 
     @staticmethod
@@ -101,7 +177,7 @@ class ZaiaService:
         Busca chat existente para o telefone usando a API correta da Zaia.
         Usa o endpoint retrieve-multiple com filtros adequados.
         """
-        logger.info(f"🔍 BUSCANDO chat existente para {phone}")
+        logger.info("🔍 BUSCANDO chat existente para %s", phone)
         
         try:
             # Usar o endpoint correto conforme documentação
@@ -112,8 +188,8 @@ class ZaiaService:
                 "offset": 0
             }
             
-            logger.info(f"🔍 Consultando API Zaia: {url}")
-            logger.info(f"🔍 Parâmetros: {params}")
+            logger.info("🔍 Consultando API Zaia: %s", url)
+            logger.info("🔍 Parâmetros: %s", params)
             
             response = requests.get(url, params=params, headers=headers, timeout=10)
             
@@ -125,34 +201,31 @@ class ZaiaService:
             chats = data.get("externalGenerativeChats", [])
             
             if not chats:
-                logger.info(f"📄 Nenhum chat encontrado para o agente {agent_id}")
+                logger.info("📄 Nenhum chat encontrado para o agente %s", agent_id)
                 return None
             
-            logger.info(f"📋 Encontrados {len(chats)} chats, analisando...")
+            logger.info("📋 Encontrados %s chats, analisando...", len(chats))
             
             # Buscar chat para este telefone específico
             # Ordenar por data de criação (mais recentes primeiro)
             chats_sorted = sorted(chats, key=lambda x: x.get('createdAt', ''), reverse=True)
             
-            for chat in chats_sorted:
-                chat_id = chat.get("id")
-                chat_phone = chat.get("phoneNumber")
-                channel = chat.get("channel")
-                status = chat.get("status")
-                external_id = chat.get("externalId")
-                created_at = chat.get("createdAt")
-                
-                logger.info(f"🔍 Analisando chat {chat_id}: phone={chat_phone}, channel={channel}, status={status}, externalId={external_id}")
-                
-                # Filtrar apenas chats ativos do WhatsApp para este telefone
-                if (status == "active" and 
-                    channel == "whatsapp" and 
-                    chat_phone == phone):
-                    
-                    logger.info(f"✅ CHAT ENCONTRADO para {phone} - Chat ID: {chat_id} (criado em: {created_at})")
-                    return chat_id
-            
-            logger.info(f"❌ Nenhum chat ativo encontrado para {phone}")
+            if logger.isEnabledFor(logging.DEBUG):
+                for chat in chats_sorted:
+                    logger.debug("🔍 Analisando chat %s: phone=%s, channel=%s, status=%s, externalId=%s", chat.get("id"), chat.get("phoneNumber"), chat.get("channel"), chat.get("status"), chat.get("externalId"))
+            
+            # Primeiro chat ativo do WhatsApp para este telefone
+            wanted = (phone, _WHATSAPP, _ACTIVE)
+            matching_chat = next(
+                (c for c in chats_sorted
+                 if (c.get("phoneNumber"), c.get("channel"), c.get("status")) == wanted),
+                None,
+            )
+            if matching_chat is not None:
+                logger.info("✅ CHAT ENCONTRADO para %s - Chat ID: %s (criado em: %s)", phone, matching_chat.get("id"), matching_chat.get("createdAt"))
+                return matching_chat.get("id")
+            
+            logger.info("❌ Nenhum chat ativo encontrado para %s", phone)
             return None
             
         except Exception as e:
@@ -160,62 +233,62 @@ class ZaiaService:
             return None
 
     @staticmethod
-    async def _verify_chat_functional(base_url: str, headers: dict, chat_id: int) -> bool:
+    async def _verify_chat_functional(chat_id: int) -> bool:
         """
         Verifica se um chat está realmente funcional fazendo uma verificação leve.
         """
         try:
             # Fazer uma requisição simples para verificar se o chat existe
-            url = f"{base_url}/v1.1/api/external-generative-chat/retrieve"
-            params = {"id": chat_id}
-            
-            response = requests.get(url, params=params, headers=headers, timeout=5)
-            
-            if response.status_code == 200:
-                chat_data = response.json()
-                status = chat_data.get("status")
-                logger.info(f"🔍 Chat {chat_id} verificado - Status: {status}")
-                return status == "active"
-            else:
-                logger.warning(f"⚠️ Chat {chat_id} não encontrado na verificação: {response.status_code}")
-                return False
+            url = _RETRIEVE_CHAT_URL.with_query(id=chat_id)
+            
+            async with _get_session().get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status == 200:
+                    chat_data = orjson.loads(await response.read())
+                    status = chat_data.get("status")
+                    logger.info("🔍 Chat %s verificado - Status: %s", chat_id, status)
+                    return status == "active"
+                else:
+                    logger.warning("⚠️ Chat %s não encontrado na verificação: %s", chat_id, response.status)
+                    return False
                 
         except Exception as e:
-            logger.warning(f"⚠️ Erro ao verificar chat {chat_id}: {str(e)}")
+            logger.warning("⚠️ Erro ao verificar chat %s: %s", chat_id, e)
             return False
 
     @staticmethod
-    async def _create_new_chat(base_url: str, headers: dict, agent_id: str, phone: str) -> int:
+    async def _create_new_chat(phone: str) -> int:
         """
         Cria um novo chat na Zaia usando payload mínimo conforme documentação.
         """
-        logger.info(f"🆕 CRIANDO NOVO CHAT para {phone}")
+        logger.info("🆕 CRIANDO NOVO CHAT para %s", phone)
         
         # Payload mínimo conforme documentação da Zaia
         payload = {
-            "agentId": int(agent_id)
+            "agentId": _AGENT_ID
         }
         
-        url = f"{base_url}/v1.1/api/external-generative-chat/create"
-        logger.info(f"🆕 URL: {url}")
-        logger.info(f"🆕 Payload: {payload}")
+        logger.info("🆕 URL: %s", _CREATE_CHAT_URL)
+        logger.debug("🆕 Payload: %s", payload)
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
-            logger.info(f"🆕 Resposta da criação - Status: {response.status_code}")
-            logger.info(f"🆕 Resposta completa: {response.text}")
-            
-            if response.status_code in [200, 201]:
-                chat_data = response.json()
-                chat_id = chat_data.get("id")
-                logger.info(f"✅ NOVO CHAT CRIADO para {phone} - Chat ID: {chat_id}")
-                return chat_id
-            else:
-                error_text = response.text
-                logger.error(f"❌ Erro ao criar chat: {response.status_code} - {error_text}")
-                raise Exception(f"Erro ao criar chat: {response.status_code} - {error_text}")
+            async with _get_session().post(_CREATE_CHAT_URL, data=orjson.dumps(payload), timeout=_CREATE_CHAT_TIMEOUT) as response:
+                # Bytes direto para o orjson: o corpo só vira str no log em DEBUG ou em caso de erro
+                body = await response.read()
+                logger.info("🆕 Resposta da criação - Status: %s", response.status)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("🆕 Resposta completa: %s", body.decode(errors="replace"))
+                
+                if response.status in [200, 201]:
+                    chat_data = orjson.loads(body)
+                    chat_id = chat_data.get("id")
+                    logger.info("✅ NOVO CHAT CRIADO para %s - Chat ID: %s", phone, chat_id)
+                    return chat_id
+                else:
+                    response_text = body.decode(errors="replace")
+                    logger.error(f"❌ Erro ao criar chat: {response.status} - {response_text}")
+                    raise Exception(f"Erro ao criar chat: {response.status} - {response_text}")
                 
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logger.error(f"❌ Erro de rede ao criar chat: {str(e)}")
             raise Exception(f"Erro de rede ao criar chat: {str(e)}")
 
@@ -225,19 +298,12 @@ class ZaiaService:
         Envia mensagem para a Zaia.
         O contexto do CRM agora é injetado diretamente no prompt.
         """
-        logger.info(f"=== ENVIANDO MENSAGEM PARA ZAIA ===")
-        logger.info(f"📨 Dados: {message} | Metadados: {metadata}")
+        logger.info("=== ENVIANDO MENSAGEM PARA ZAIA ===")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📨 Dados: %s | Metadados: %s", message, metadata)
         
-        settings = Settings()
-        base_url = settings.ZAIA_BASE_URL.rstrip("/")
-        agent_id = settings.ZAIA_AGENT_ID
-        api_key = settings.ZAIA_API_KEY
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+        if _AGENT_ID is None:
+            raise Exception("Configurações da Zaia incompletas")
         
         # Extrai o texto do prompt (que agora vem enriquecido)
         message_text = message.get('text')
@@ -248,7 +314,11 @@ class ZaiaService:
         if not phone:
             raise Exception("Telefone não informado")
             
-        logger.info(f"📱 Mensagem: '{message_text}' | Telefone: {phone}")
+        logger.info("📱 Mensagem: '%s' | Telefone: %s", message_text, phone)
+        
+        if _breaker.is_open:
+            logger.warning("⚠️ Zaia indisponível (circuito aberto). Mensagem de %s não enviada.", phone)
+            raise Exception("Zaia indisponível (circuito aberto)")
         
         try:
             # Monta o campo 'custom' dinamicamente
@@ -257,7 +327,7 @@ class ZaiaService:
                 custom_data.update(metadata)
 
             payload = {
-                "agentId": int(agent_id),
+                "agentId": _AGENT_ID,
                 "externalGenerativeChatExternalId": phone,
                 "prompt": message_text,
                 "streaming": False,
@@ -265,36 +335,48 @@ class ZaiaService:
                 "custom": custom_data
             }
             
-            url_message = f"{base_url}/v1.1/api/external-generative-message/create"
-            logger.info(f"📤 Enviando mensagem para Zaia...")
-            logger.info(f"📤 Payload completo: {payload}")
+            logger.info("📤 Enviando mensagem para Zaia...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📤 Payload completo: %s", payload)
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url_message, headers=headers, json=payload) as response:
-                    logger.info(f"📥 Status: {response.status}")
+            async with _get_session().post(_CREATE_MESSAGE_URL, data=orjson.dumps(payload), timeout=_MESSAGE_TIMEOUT) as response:
+                logger.info("📥 Status: %s", response.status)
+                # Erros 5xx indicam serviço fora do ar; 4xx são problemas da requisição
+                if response.status >= 500:
+                    _breaker.record_failure()
+                else:
+                    _breaker.record_success()
                     
-                    if response.status == 200:
-                        response_json = await response.json()
+                if response.status == 200:
+                    response_json = orjson.loads(await response.read())
                         
-                        # Extrair informações da resposta
-                        chat_id = response_json.get('externalGenerativeChatId')
-                        ai_response = response_json.get('text', 'Erro ao obter resposta')
+                    # Extrair informações da resposta
+                    chat_id = response_json.get('externalGenerativeChatId')
+                    ai_response = response_json.get('text', 'Erro ao obter resposta')
                         
-                        logger.info(f"✅ Chat ID usado pela Zaia: {chat_id}")
-                        logger.info(f"🤖 Resposta da IA: {ai_response[:100]}...")
+                    logger.info("✅ Chat ID usado pela Zaia: %s", chat_id)
+                    logger.info("🤖 Resposta da IA: %s...", ai_response[:100])
                         
-                        # Salvar chat ID no cache para logs futuros (opcional)
-                        if chat_id:
-                            await CacheService.set_chat_id(phone, chat_id)
+                    # Salvar chat ID no cache para logs futuros (opcional)
+                    if chat_id:
+                        await CacheService.set_chat_id(phone, chat_id)
+                        ZaiaService._chat_cache[phone] = chat_id
                         
-                        return response_json
+                    return response_json
                         
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"❌ Erro na API Zaia: {response.status} - {error_text}")
-                        logger.error(f"📤 Payload enviado: {payload}")
-                        raise Exception(f"Erro ao enviar mensagem: {response.status} - {error_text}")
+                else:
+                    error_text = await response.text()
+                    # Chat recusado pela Zaia: o ID em memória não serve mais
+                    if response.status < 500 and "externalGenerativeChatId" in error_text:
+                        ZaiaService._chat_cache.pop(phone, None)
+                    logger.error(f"❌ Erro na API Zaia: {response.status} - {error_text}")
+                    logger.error(f"📤 Payload enviado: {payload}")
+                    raise Exception(f"Erro ao enviar mensagem: {response.status} - {error_text}")
                         
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            _breaker.record_failure()
+            logger.error(f"❌ Erro ao processar mensagem para {phone}: {str(e)}")
+            raise
         except Exception as e:
             logger.error(f"❌ Erro ao processar mensagem para {phone}: {str(e)}")
             raise 
@@ -305,31 +387,22 @@ class ZaiaService:
         Busca o histórico completo de mensagens de um chat na Zaia.
         Retorna uma lista de dicionários com origin e text.
         """
-        settings = Settings()
-        base_url = settings.ZAIA_BASE_URL.rstrip("/")
-        api_key = settings.ZAIA_API_KEY
-        
-        url_retrieve = f"{base_url}/v1.1/api/external-generative-message/retrieve-multiple?externalGenerativeChatIds={chat_id}"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+        url_retrieve = _RETRIEVE_MESSAGES_URL.with_query(externalGenerativeChatIds=chat_id)
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url_retrieve, headers=headers) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        chats = data.get("externalGenerativeChats", [])
-                        if chats:
-                            messages = chats[0].get("externalGenerativeMessages", [])
-                            logger.info(f"📜 Encontradas {len(messages)} mensagens no histórico do chat {chat_id}")
-                            return [{"origin": m.get("origin"), "text": m.get("text")} for m in messages]
-                        return []
-                    else:
-                        raw_text = await resp.text()
-                        logger.error(f"❌ Erro ao buscar histórico da Zaia (status {resp.status}): {raw_text}")
-                        return []
+            async with _get_session().get(url_retrieve) as resp:
+                if resp.status == 200:
+                    data = orjson.loads(await resp.read())
+                    chats = data.get("externalGenerativeChats", [])
+                    if chats:
+                        messages = chats[0].get("externalGenerativeMessages", [])
+                        logger.info("📜 Encontradas %s mensagens no histórico do chat %s", len(messages), chat_id)
+                        return [{"origin": m.get("origin"), "text": m.get("text")} for m in messages]
+                    return []
+                else:
+                    raw_text = await resp.text()
+                    logger.error(f"❌ Erro ao buscar histórico da Zaia (status {resp.status}): {raw_text}")
+                    return []
         except Exception as e:
             logger.error(f"❌ Erro ao buscar histórico do chat {chat_id}: {str(e)}")
             return [] 
@@ -340,74 +413,50 @@ class ZaiaService:
         Busca o chat ativo para um telefone específico na API da Zaia.
         Retorna o chat_id do chat ativo mais recente ou None se não encontrar.
         """
-        settings = Settings()
-        base_url = settings.ZAIA_BASE_URL.rstrip("/")
-        agent_id = settings.ZAIA_AGENT_ID
-        api_key = settings.ZAIA_API_KEY
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        
         try:
             # Buscar chats do agente, ordenados por data de criação (mais recentes primeiro)
-            url = f"{base_url}/v1.1/api/external-generative-chat/retrieve-multiple"
-            params = {
-                "agentIds": [int(agent_id)],
-                "limit": 50,  # Buscar uma quantidade razoável
-                "offset": 0,
-                "sortBy": "createdAt",
-                "sortOrder": "desc"
-            }
-            
-            logger.info(f"🔍 Consultando API Zaia: {url}")
-            response = requests.get(url, params=params, headers=headers, timeout=15)
-            
-            if response.status_code != 200:
-                logger.error(f"❌ Erro na busca de chats: {response.status_code} - {response.text}")
-                return None
-                
-            data = response.json()
+            url = _RETRIEVE_CHATS_URL.with_query(
+                agentIds=_AGENT_ID,
+                limit=50,  # Buscar uma quantidade razoável
+                offset=0,
+                sortBy="createdAt",
+                sortOrder="desc"
+            )
+            
+            logger.info("🔍 Consultando API Zaia: %s", url)
+            async with _get_session().get(url) as response:
+                if response.status != 200:
+                    logger.error(f"❌ Erro na busca de chats: {response.status} - {await response.text()}")
+                    return None
+                    
+                data = orjson.loads(await response.read())
             all_chats = data.get("externalGenerativeChats", [])
             
-            logger.info(f"📋 Encontrados {len(all_chats)} chats totais")
-            
-            # Filtrar apenas chats ativos do WhatsApp para este telefone específico
-            # Primeiro, coletar todos os chats válidos para este telefone
-            valid_chats = []
-            for chat in all_chats:
-                chat_id = chat.get("id")
-                chat_phone = chat.get("phoneNumber")
-                channel = chat.get("channel")
-                status = chat.get("status")
-                created_at = chat.get("createdAt")
-                
-                logger.info(f"🔍 Chat {chat_id}: phone={chat_phone}, channel={channel}, status={status}")
-                
-                # Encontrar chat ativo do WhatsApp para este telefone
-                if (channel == "whatsapp" and 
-                    chat_phone == phone and
-                    status == "active"):
-                    
-                    valid_chats.append({
-                        "id": chat_id,
-                        "created_at": created_at
-                    })
-                    logger.info(f"✅ Chat válido encontrado: {chat_id} (criado: {created_at})")
-            
-            # Se encontrou chats válidos, retornar o mais recente
-            if valid_chats:
-                # Ordenar por data de criação (mais recente primeiro)
-                valid_chats.sort(key=lambda x: x["created_at"], reverse=True)
-                most_recent_chat = valid_chats[0]
-                logger.info(f"🎯 CHAT MAIS RECENTE para {phone}: {most_recent_chat['id']} (criado: {most_recent_chat['created_at']})")
-                return most_recent_chat["id"]
-            
-            logger.info(f"❌ Nenhum chat ativo encontrado para {phone}")
+            logger.info("📋 Encontrados %s chats totais", len(all_chats))
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                for chat in all_chats:
+                    logger.debug("🔍 Chat %s: phone=%s, channel=%s, status=%s", chat.get("id"), chat.get("phoneNumber"), chat.get("channel"), chat.get("status"))
+            
+            # Chat ativo do WhatsApp mais recente para este telefone, em uma única passada
+            # (sem lista intermediária nem ordenação)
+            wanted = (phone, _WHATSAPP, _ACTIVE)
+            most_recent_chat = max(
+                (c for c in all_chats
+                 if (c.get("phoneNumber"), c.get("channel"), c.get("status")) == wanted),
+                key=lambda c: c.get("createdAt") or "",
+                default=None,
+            )
+            if most_recent_chat is not None:
+                logger.info("🎯 CHAT MAIS RECENTE para %s: %s (criado: %s)", phone, most_recent_chat.get("id"), most_recent_chat.get("createdAt"))
+                return most_recent_chat.get("id")
+            
+            logger.info("❌ Nenhum chat ativo encontrado para %s", phone)
             return None
             
+        except asyncio.TimeoutError:
+            # Sem resposta não dá para saber se o chat existe: criar outro geraria duplicata
+            raise
         except Exception as e:
             logger.error(f"❌ Erro ao buscar chat ativo: {str(e)}")
             return None
@@ -418,29 +467,21 @@ class ZaiaService:
         Busca robusta que encontra o chat mais recente com atividade para um telefone específico.
         Analisa múltiplos chats e suas mensagens para determinar qual foi usado por último.
         """
-        settings = Settings()
-        base_url = settings.ZAIA_BASE_URL.rstrip("/")
-        agent_id = settings.ZAIA_AGENT_ID
-        api_key = settings.ZAIA_API_KEY
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+        agent_id = _AGENT_ID
+        headers = _HEADERS
         
         try:
             # 1. Buscar todos os chats do agente (mais recentes primeiro)
-            url = f"{base_url}/v1.1/api/external-generative-chat/retrieve-multiple"
+            url = _RETRIEVE_CHATS_URL
             params = {
-                "agentIds": [int(agent_id)],
+                "agentIds": [agent_id],
                 "limit": 100,  # Aumentar limite para busca mais ampla
                 "offset": 0,
                 "sortBy": "createdAt",
                 "sortOrder": "desc"
             }
             
-            logger.info(f"🔍 Buscando chats para {phone} na API da Zaia...")
+            logger.info("🔍 Buscando chats para %s na API da Zaia...", phone)
             response = requests.get(url, params=params, headers=headers, timeout=15)
             
             if response.status_code != 200:
@@ -451,34 +492,29 @@ class ZaiaService:
             all_chats = data.get("externalGenerativeChats", [])
             
             if not all_chats:
-                logger.info(f"📄 Nenhum chat encontrado no agente {agent_id}")
+                logger.info("📄 Nenhum chat encontrado no agente %s", agent_id)
                 return None
             
-            logger.info(f"📋 Encontrados {len(all_chats)} chats totais, filtrando por telefone {phone}...")
+            logger.info("📋 Encontrados %s chats totais, filtrando por telefone %s...", len(all_chats), phone)
             
             # 2. Filtrar chats do WhatsApp para este telefone específico
+            wanted = (phone, _WHATSAPP, _ACTIVE)
             phone_chats = []
             for chat in all_chats:
-                chat_id = chat.get("id")
-                chat_phone = chat.get("phoneNumber")
-                channel = chat.get("channel")
-                status = chat.get("status")
-                created_at = chat.get("createdAt")
+                chat_phone, channel, status = chat.get("phoneNumber"), chat.get("channel"), chat.get("status")
                 
-                logger.info(f"🔍 Analisando chat {chat_id}: phone={chat_phone}, channel={channel}, status={status}")
+                logger.debug("🔍 Analisando chat %s: phone=%s, channel=%s, status=%s", chat.get("id"), chat_phone, channel, status)
                 
                 # Filtrar apenas chats ativos do WhatsApp para este telefone
-                if (channel == "whatsapp" and 
-                    chat_phone == phone and
-                    status == "active"):
+                if (chat_phone, channel, status) == wanted:
                     phone_chats.append(chat)
-                    logger.info(f"✅ Chat válido encontrado: {chat_id} (criado: {created_at})")
+                    logger.info("✅ Chat válido encontrado: %s (criado: %s)", chat.get("id"), chat.get("createdAt"))
             
             if not phone_chats:
-                logger.info(f"📄 Nenhum chat ativo do WhatsApp encontrado para {phone}")
+                logger.info("📄 Nenhum chat ativo do WhatsApp encontrado para %s", phone)
                 return None
             
-            logger.info(f"📋 {len(phone_chats)} chats válidos encontrados para {phone}")
+            logger.info("📋 %s chats válidos encontrados para %s", len(phone_chats), phone)
             
             # 3. Ordenar chats por data de criação (mais recentes primeiro) e pegar o primeiro
             phone_chats.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
@@ -497,7 +533,7 @@ class ZaiaService:
                 
                 try:
                     # Buscar mensagens deste chat específico
-                    messages_url = f"{base_url}/v1.1/api/external-generative-message/retrieve-multiple"
+                    messages_url = _RETRIEVE_MESSAGES_URL
                     messages_params = {
                         "externalGenerativeChatIds": [chat_id],
                         "limit": 10,  # Aumentar para ter mais contexto
@@ -517,17 +553,17 @@ class ZaiaService:
                             last_message = chat_messages[0]
                             last_message_time = last_message.get("createdAt")
                             
-                            logger.info(f"📅 Chat {chat_id}: última mensagem em {last_message_time} ({len(chat_messages)} mensagens)")
+                            logger.info("📅 Chat %s: última mensagem em %s (%s mensagens)", chat_id, last_message_time, len(chat_messages))
                             
                             # Priorizar chats com atividade muito recente
                             try:
                                 message_date = datetime.fromisoformat(last_message_time.replace('Z', '+00:00'))
                                 if message_date > recent_threshold:
-                                    logger.info(f"🔥 Chat {chat_id} tem atividade recente (últimas 24h)")
+                                    logger.info("🔥 Chat %s tem atividade recente (últimas 24h)", chat_id)
                                     if latest_activity_time is None or last_message_time > latest_activity_time:
                                         latest_activity_time = last_message_time
                                         chat_with_last_activity = chat
-                                        logger.info(f"🎯 Novo chat mais recente: {chat_id}")
+                                        logger.info("🎯 Novo chat mais recente: %s", chat_id)
                                         break  # Se encontrou um chat com atividade recente, usar esse
                             except:
                                 pass
@@ -536,31 +572,31 @@ class ZaiaService:
                             if latest_activity_time is None or last_message_time > latest_activity_time:
                                 latest_activity_time = last_message_time
                                 chat_with_last_activity = chat
-                                logger.info(f"🎯 Novo chat mais recente: {chat_id}")
+                                logger.info("🎯 Novo chat mais recente: %s", chat_id)
                         else:
                             # Se não há mensagens, usar data de criação do chat apenas se não temos nada melhor
-                            logger.info(f"📅 Chat {chat_id}: sem mensagens, usando data de criação {created_at}")
+                            logger.info("📅 Chat %s: sem mensagens, usando data de criação %s", chat_id, created_at)
                             if latest_activity_time is None:
                                 latest_activity_time = created_at
                                 chat_with_last_activity = chat
                     else:
-                        logger.warning(f"⚠️ Erro ao buscar mensagens do chat {chat_id}: {messages_response.status_code}")
+                        logger.warning("⚠️ Erro ao buscar mensagens do chat %s: %s", chat_id, messages_response.status_code)
                         # Só usar data de criação se não temos nada melhor
                         if latest_activity_time is None:
                             latest_activity_time = created_at
                             chat_with_last_activity = chat
                             
                 except Exception as e:
-                    logger.warning(f"⚠️ Erro ao analisar atividade do chat {chat_id}: {str(e)}")
+                    logger.warning("⚠️ Erro ao analisar atividade do chat %s: %s", chat_id, e)
                     continue
             
             # 4. Retornar o chat com atividade mais recente
             if chat_with_last_activity:
                 final_chat_id = chat_with_last_activity.get("id")
-                logger.info(f"🎯 CHAT MAIS RECENTE para {phone}: {final_chat_id} (última atividade: {latest_activity_time})")
+                logger.info("🎯 CHAT MAIS RECENTE para %s: %s (última atividade: %s)", phone, final_chat_id, latest_activity_time)
                 return final_chat_id
             else:
-                logger.info(f"❌ Nenhum chat com atividade encontrado para {phone}")
+                logger.info("❌ Nenhum chat com atividade encontrado para %s", phone)
                 return None
             
         except Exception as e:
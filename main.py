@@ -43,6 +43,13 @@ import cloudinary.uploader
 import cloudinary.api
 from app.config.settings import Settings
 from app.routes.webhook_routes import router as webhook_router
+from app.services.elevenlabs_service import ElevenLabsService
+from app.services.intent_service import IntentService
+from app.services.notion_service import NotionService
+from app.services.whisper_service import WhisperService
+from app.services.z_api_service import ZAPIService
+from app.services.zaia_service import ZaiaService
+from app.services.openai_client import close as close_openai_client, get_openai_client
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -73,6 +80,22 @@ cloudinary.config(
 # Register routers
 app.include_router(webhook_router, prefix="/webhook")
 
+@app.on_event("startup")
+async def warmup_http_sessions():
+    # Abre as conexões com a Z-API antes da primeira mensagem
+    await ZAPIService.warmup()
+
+@app.on_event("shutdown")
+async def close_http_sessions():
+    # Fecha as sessões HTTP compartilhadas pelos serviços
+    await ElevenLabsService.close()
+    await IntentService.close()
+    await NotionService.close()
+    await WhisperService.close()
+    await ZAPIService.close()
+    await ZaiaService.close()
+    await close_openai_client()
+
 # Forçando reconstrução da imagem no Cloud Run
 @app.get("/")
 async def healthcheck():
@@ -168,12 +191,11 @@ ZAIA_AGENT_ID = os.getenv("ZAIA_AGENT_ID")
 ZAIA_API_URL = f"{settings.ZAIA_BASE_URL}/v1.1/api/message-cross-channel/create"
 
 # OpenAI Configuration
-import openai
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("Missing OPENAI_API_KEY environment variable")
 
-openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+openai_client = get_openai_client()
 
 # Z-API Configuration
 Z_API_ID = os.getenv("Z_API_ID")
@@ -255,13 +277,10 @@ async def download_audio(url: str) -> str:
             if response.status != 200:
                 raise Exception(f"Failed to download audio: {response.status}")
             
-            # Create temporary file with .mp3 extension
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-            temp_file.close()
-            
-            # Write audio content to file
-            with open(temp_file.name, 'wb') as f:
-                f.write(await response.read())
+            # Create temporary file with .mp3 extension and stream the body into it in chunks
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    temp_file.write(chunk)
             
             return temp_file.name
 
@@ -352,102 +371,14 @@ async def send_to_zaia(message):
         async with session.post(url, headers=headers, json=payload) as response:
             return await response.json()
 
-async def send_text_via_z_api(phone: str, message: str):
-    """
-    Envia mensagem de texto via Z-API
-    """
-    url = f"https://api.z-api.io/instances/{Z_API_ID}/token/{Z_API_TOKEN}/send-text"
-    headers = {
-        "Content-Type": "application/json",
-        "Client-Token": Z_API_SECURITY_TOKEN
-    }
-    
-    payload = {
-        "phone": phone,
-        "message": message
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            logger.info(f"Enviando mensagem para {phone}. URL: {url}")
-            logger.info(f"Payload: {payload}")
-            async with session.post(url, headers=headers, json=payload) as response:
-                response_text = await response.text()
-                logger.info(f"Resposta do Z-API: Status={response.status}, Body={response_text}")
-                if response.status == 200:
-                    logger.info(f"Mensagem enviada para {phone}")
-                    return {"success": True}
-                else:
-                    error_text = f"Status: {response.status}, Response: {response_text}"
-                    logger.error(f"Erro ao enviar mensagem: {error_text}")
-                    return {"error": error_text}
-        except Exception as e:
-            logger.error(f"Exceção ao enviar mensagem: {str(e)}")
-            return {"error": str(e)}
-
-async def send_audio_via_z_api(phone: str, audio_bytes: bytes):
-    """
-    Envia áudio via Z-API.
-    O áudio deve estar em formato OGG ou MP3 (preferencialmente OGG para WhatsApp PTT).
-    """
-    url = f"https://api.z-api.io/instances/{Z_API_ID}/token/{Z_API_TOKEN}/send-audio"
-    try:
-        # Codificar o áudio em base64 e adicionar o prefixo
-        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-        audio_data_url = f"data:audio/ogg;base64,{audio_base64}"
-
-        payload = {
-            "phone": phone,
-            "audio": audio_data_url,
-            "viewOnce": False,
-            "waveform": True
-        }
-
-        headers = {
-            "Content-Type": "application/json",
-            "Client-Token": Z_API_SECURITY_TOKEN
-        }
-
-        async with aiohttp.ClientSession() as session:
-            logger.info(f"Enviando áudio para {phone}. URL: {url}")
-            async with session.post(url, headers=headers, json=payload) as response:
-                response_text = await response.text()
-                logger.info(f"Resposta do Z-API (áudio): Status={response.status}, Body={response_text}")
-                if response.status == 200:
-                    logger.info(f"Áudio enviado para {phone}")
-                    return {"success": True}
-                else:
-                    error_text = f"Status: {response.status}, Response: {response_text}"
-                    logger.error(f"Erro ao enviar áudio: {error_text}")
-                    return {"error": error_text}
-    except Exception as e:
-        logger.error(f"Exceção ao enviar áudio: {str(e)}")
-        return {"error": str(e)}
-
 async def process_audio_message(audio_url):
     """
     Processa mensagem de áudio: baixa, transcreve e retorna o texto
     """
-    # Download do arquivo de áudio
-    audio_response = requests.get(audio_url)
-    
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_audio:
-        temp_audio.write(audio_response.content)
-        temp_audio_path = temp_audio.name
-    
-    try:
-        # Transcreve o áudio usando OpenAI Whisper API
-        with open(temp_audio_path, "rb") as audio_file:
-            transcript = await openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="pt",
-                response_format="text"
-            )
-        return transcript
-    finally:
-        # Remove o arquivo temporário
-        os.unlink(temp_audio_path)
+    # Download do arquivo de áudio em blocos direto para o arquivo temporário
+    temp_audio_path = await download_audio(audio_url)
+    # Transcreve o áudio usando OpenAI Whisper API (o arquivo temporário é removido ao final)
+    return await transcribe_audio(temp_audio_path)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8080))
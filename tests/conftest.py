@@ -0,0 +1,8 @@
+import os
+import sys
+
+# A aplicação lê as configurações no import: valores fictícios para os campos obrigatórios
+os.environ.setdefault("NOTION_API_KEY", "test")
+os.environ.setdefault("NOTION_DATABASE_ID", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+redis = pytest.importorskip("redis")
+
+from app.services.cache_service import CacheService
+
+
+class _FlakyRedis:
+    """Cliente falso: cada chamada a exists consome o próximo resultado do roteiro."""
+
+    def __init__(self, script):
+        self.script = list(script)
+
+    async def exists(self, key):
+        if self.script.pop(0):
+            return 0
+        raise redis.ConnectionError("falha simulada")
+
+
+@pytest.fixture
+def flaky_redis(monkeypatch):
+    def install(script):
+        monkeypatch.setattr(CacheService, "_redis_client", _FlakyRedis(script))
+        monkeypatch.setattr(CacheService, "_get_redis_client", CacheService._get_connected_client)
+        CacheService._breaker.record_success()
+
+    yield install
+    CacheService._breaker.record_success()
+
+
+def _run_override_checks(count):
+    async def run():
+        for _ in range(count):
+            await CacheService.is_human_override_active("5511999999999")
+
+    asyncio.run(run())
+
+
+def test_success_resets_redis_failure_count(flaky_redis):
+    # 4 falhas, 1 sucesso, 1 falha: não são 5 falhas seguidas, o circuito continua fechado
+    flaky_redis([False, False, False, False, True, False])
+    _run_override_checks(6)
+
+    assert CacheService._breaker.is_closed
+    assert CacheService._breaker.failures == 1
+
+
+def test_consecutive_redis_failures_open_circuit(flaky_redis):
+    flaky_redis([False] * 5)
+    _run_override_checks(5)
+
+    assert CacheService._breaker.is_open
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from app.services import notion_service
+from app.services.cache_service import CacheService
+from app.services.notion_service import NotionService
+
+
+def _patch_lookup(monkeypatch, service, claimed):
+    calls = {"upserts": [], "released": []}
+
+    async def find_page(phone):
+        return None
+
+    async def claim(phone):
+        return claimed
+
+    async def release(phone):
+        calls["released"].append(phone)
+
+    async def upsert(page_id, *args):
+        calls["upserts"].append(page_id)
+
+    monkeypatch.setattr(notion_service, "_CREATE_WAIT_INTERVAL", 0)
+    monkeypatch.setattr(service, "_find_page_by_phone", find_page)
+    monkeypatch.setattr(service, "_cached_page_id", find_page)
+    monkeypatch.setattr(service, "_upsert_lead", upsert)
+    monkeypatch.setattr(CacheService, "claim_notion_page_creation", claim)
+    monkeypatch.setattr(CacheService, "release_notion_page_creation", release)
+    return calls
+
+
+def test_lost_claim_does_not_create_page(monkeypatch):
+    service = NotionService()
+    calls = _patch_lookup(monkeypatch, service, claimed=False)
+
+    created = asyncio.run(service.create_or_update_lead("Ana", "5511999999999"))
+
+    assert created is False
+    assert calls["upserts"] == []
+    assert calls["released"] == []
+    assert notion_service._create_locks == {}
+
+
+def test_claim_is_released_after_create(monkeypatch):
+    service = NotionService()
+    calls = _patch_lookup(monkeypatch, service, claimed=True)
+
+    created = asyncio.run(service.create_or_update_lead("Ana", "5511999999999"))
+
+    assert created is True
+    assert calls["upserts"] == [None]
+    assert calls["released"] == ["5511999999999"]
+    assert notion_service._create_locks == {}
+
+
+class _Response:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+def test_archived_cached_page_falls_back_to_search(monkeypatch):
+    service = NotionService()
+    invalidated = []
+
+    async def cached_page_id(phone):
+        return "old-page"
+
+    async def request(method, url, payload=None, params=None):
+        return _Response(b'{"id": "old-page", "archived": true, "properties": {}}')
+
+    async def invalidate(phone):
+        invalidated.append(phone)
+
+    async def find_page_full(phone, filter_properties=None):
+        return {"id": "new-page", "url": "https://notion.so/new-page", "properties": {}}
+
+    monkeypatch.setattr(service, "_cached_page_id", cached_page_id)
+    monkeypatch.setattr(service, "_request", request)
+    monkeypatch.setattr(service, "invalidate", invalidate)
+    monkeypatch.setattr(service, "_find_page_by_phone_full", find_page_full)
+
+    lead = asyncio.run(service.get_lead_data_by_phone("5511999999999"))
+
+    assert invalidated == ["5511999999999"]
+    assert lead == {"properties": {}, "url": "https://notion.so/new-page"}